@@ -0,0 +1,146 @@
+"""
+Synthetic EDI corpus
+
+Generates transaction set data for EDIGenerator straight from the compiled
+format definitions, so benchmarks can build and parse interchanges of any
+size without hand-written fixtures. Values are drawn from a seeded random
+generator, so the same settings always give the same corpus.
+"""
+
+import datetime
+import os
+import random
+import string
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from pythonedi.schema import ENVELOPE_SEGMENTS, get_schema
+
+# The repeating loop holding each format's line items
+LINE_ITEM_LOOPS = {
+    "810": "L_IT1",
+    "850": "L_PO1",
+}
+# The name/address loop
+N1_LOOP = "L_N1"
+
+# Chance that an optional element is filled in
+OPTIONAL_ELEMENT_DENSITY = 0.5
+
+ALPHANUMERIC = string.ascii_uppercase + string.digits
+BASE_DATE = datetime.datetime(2024, 1, 1)
+
+class CorpusGenerator(object):
+    """ Builds synthetic transaction sets (as dicts) for a supported format """
+    def __init__(self, edi_format, line_items=100, n1_loops=2, seed=0):
+        self.edi_format = get_schema(edi_format)
+        self.line_items = line_items
+        self.n1_loops = n1_loops
+        self.random = random.Random(seed)
+        self._usable = {}
+
+    def element_value(self, element):
+        """ Returns a random value of the right Python type for an element """
+        rng = self.random
+        data_type = element.data_type
+        if data_type == "ID" and element.data_type_ids:
+            return rng.choice(sorted(element.data_type_ids))
+        elif data_type in ("AN", "ID"):
+            length = rng.randint(element.min_length, max(element.min_length, min(element.max_length, 12)))
+            return "".join(rng.choice(ALPHANUMERIC) for _ in range(length))
+        elif data_type in ("DT", "TM"):
+            return BASE_DATE + datetime.timedelta(days=rng.randint(0, 365), minutes=rng.randint(0, 1439))
+        elif data_type == "N0":
+            return rng.randint(1, 10**min(element.max_length, 4) - 1)
+        elif data_type.startswith("N") or data_type == "R":
+            return round(rng.uniform(1, 100), 2)
+        elif element.id == "ISA16":
+            return ">"
+        return ""
+
+    def usable(self, element):
+        """ Whether the generator can format values for an element at all; a
+        few definitions give lengths no date format fits """
+        usable = self._usable.get(element)
+        if usable is None:
+            try:
+                element.format(self.element_value(element))
+                usable = True
+            except ValueError:
+                usable = False
+            self._usable[element] = usable
+        return usable
+
+    def segment(self, segment):
+        """ Returns the element list for a segment: mandatory elements, some
+        optional ones, and whatever else its syntax rules then call for """
+        rng = self.random
+        usable = [self.usable(element) for element in segment.elements]
+        values = [
+            self.element_value(element) if usable[i] and (element.req == "M" or rng.random() < OPTIONAL_ELEMENT_DENSITY) else None
+            for i, element in enumerate(segment.elements)
+        ]
+        count = len(values)
+        changed = True
+        while changed:
+            changed = False
+            for rule in segment.syntax:
+                # Criteria are one-based element positions
+                criteria = [position - 1 for position in rule["criteria"] if position <= count]
+                present = [position for position in criteria if values[position] is not None]
+                if rule["rule"] == "ATLEASTONE":
+                    required = criteria[:1] if not present else []
+                elif rule["rule"] == "ALLORNONE":
+                    required = criteria if present else []
+                elif rule["rule"] == "IFATLEASTONE":
+                    required = criteria[1:2] if criteria[:1] == present[:1] and len(present) < 2 else []
+                else:
+                    required = []
+                for position in required:
+                    if values[position] is None and usable[position]:
+                        values[position] = self.element_value(segment.elements[position])
+                        changed = True
+        # Trailing empty elements are left off, as in real messages
+        while values and values[-1] is None:
+            values.pop()
+        return values
+
+    def repeat_count(self, loop):
+        """ How many iterations to generate for a loop """
+        if loop.id == LINE_ITEM_LOOPS.get(self.edi_format.name):
+            return self.line_items
+        elif loop.id == N1_LOOP:
+            return self.n1_loops
+        return 1
+
+    def sections(self, sections):
+        """ Returns data for every segment and loop in `sections`; loops
+        other than the line item and N1 loops get one iteration """
+        data = {}
+        for section in sections:
+            if section.type == "loop":
+                data[section.id] = [self.sections(section.segments) for _ in range(self.repeat_count(section))]
+                if not data[section.id]:
+                    del data[section.id]
+            else:
+                data[section.id] = self.segment(section)
+        return data
+
+    def transaction(self):
+        """ Returns one transaction set, ST through the last segment before SE,
+        ready for `EDIGenerator.build_batch` """
+        sections = [section for section in self.edi_format.sections if section.id not in ENVELOPE_SEGMENTS and section.id != "SE"]
+        transaction = self.sections(sections)
+        # Control numbers are assigned by build_batch
+        transaction["ST"] = [self.edi_format.name]
+        return transaction
+
+    def transactions(self, count):
+        """ Returns a list of `count` transaction sets """
+        return [self.transaction() for _ in range(count)]
+
+    def envelope(self):
+        """ Returns the ISA and GS element lists for an interchange """
+        envelope = get_schema("envelope").paths
+        return self.segment(envelope["envelope/ISA"]), self.segment(envelope["envelope/GS"])
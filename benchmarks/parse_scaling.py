@@ -0,0 +1,50 @@
+"""
+Parse scaling benchmark
+
+Builds synthetic 810 invoices of increasing size from the test fixture and
+times EDIParser.parse on each. With linear-time parsing the per-segment cost
+should stay flat as the message grows.
+
+Run from the repository root: `python benchmarks/parse_scaling.py`
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import pythonedi
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "..", "test", "test_edi.txt")
+SIZES = (1000, 10000, 100000)
+
+def build_message(segment_count):
+    """ Pads the fixture's IT1/PID line items out to roughly `segment_count` segments """
+    with open(FIXTURE, "r") as fixture:
+        lines = fixture.read().splitlines()
+    first_item = next(i for i, line in enumerate(lines) if line.startswith("IT1^"))
+    header = lines[:first_item]
+    trailer = lines[first_item:]
+    trailer = trailer[next(i for i, line in enumerate(trailer) if line.startswith("TDS^")):]
+    items = []
+    line_number = 0
+    while len(header) + len(items) + len(trailer) < segment_count:
+        line_number += 1
+        items.append("IT1^{}^4^BG^25.6000^CT^VC^165911^IN^000018^MG^365985".format(line_number))
+        items.append("PID^F^^^^TUBE MICROTAINER PST W/LITHIUM")
+    return "\n".join(header + items + trailer)
+
+def main():
+    parser = pythonedi.EDIParser(edi_format="810")
+    print("{:>10} {:>12} {:>14} {:>16}".format("segments", "seconds", "segments/sec", "usec/segment"))
+    for size in SIZES:
+        message = build_message(size)
+        segments = message.count("\n") + 1
+        start = time.perf_counter()
+        parser.parse(message)
+        elapsed = time.perf_counter() - start
+        print("{:>10} {:>12.4f} {:>14.0f} {:>16.2f}".format(segments, elapsed, segments / elapsed, elapsed * 1e6 / segments))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+Benchmark suite
+
+Builds synthetic 810 and 850 interchanges (see corpus.py), then measures
+build and parse throughput in segments/sec, peak traced memory for each, and
+the cold import time of the package. Results are printed as a table and can
+be written as JSON, and a previous JSON run can be given to compare against.
+
+Run from the repository root:
+
+    python benchmarks/suite.py --json bench.json
+    python benchmarks/suite.py --line-items 1000 --compare bench.json
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from corpus import CorpusGenerator
+
+import pythonedi
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+IMPORT_PROBE = """
+import time
+start = time.perf_counter()
+import pythonedi
+print(time.perf_counter() - start)
+"""
+
+# Parser output modes measured, as EDIParser keyword arguments
+PARSE_MODES = (
+    ("parse", {}),
+    ("parse_lazy", {"lazy": True}),
+    ("parse_records", {"records": True}),
+)
+
+def best_time(function, repeat):
+    """ Returns the fastest of `repeat` calls to `function`, in seconds """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def peak_memory(function):
+    """ Returns the peak traced memory, in bytes, while calling `function` """
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def measure(function, segments, repeat):
+    seconds = best_time(function, repeat)
+    return {
+        "seconds": seconds,
+        "segments_per_sec": segments / seconds,
+        "peak_bytes": peak_memory(function),
+    }
+
+def import_time(repeat):
+    """ Returns the fastest cold `import pythonedi`, each in a fresh interpreter """
+    return min(
+        float(subprocess.check_output([sys.executable, "-c", IMPORT_PROBE], cwd=ROOT))
+        for _ in range(repeat)
+    )
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_format(edi_format, args):
+    """ Benchmarks building and parsing one synthetic interchange of `edi_format` """
+    corpus = CorpusGenerator(edi_format, line_items=args.line_items, n1_loops=args.n1_loops, seed=args.seed)
+    isa, gs = corpus.envelope()
+    transactions = corpus.transactions(args.transactions)
+
+    generator = pythonedi.EDIGenerator()
+    message = generator.build_batch(isa, gs, transactions)
+    segments = message.count(generator.segment_delimiter) + 1
+
+    results = {
+        "build": measure(lambda: generator.build_batch(isa, gs, transactions), segments, args.repeat),
+    }
+    for name, options in PARSE_MODES:
+        parser = pythonedi.EDIParser(**options)
+        results[name] = measure(lambda: parser.parse_batch(message), segments, args.repeat)
+    return {
+        "format": edi_format,
+        "transactions": args.transactions,
+        "line_items": args.line_items,
+        "n1_loops": args.n1_loops,
+        "segments": segments,
+        "bytes": len(message.encode("utf-8")),
+        "results": results,
+    }
+
+def print_table(report, baseline=None):
+    previous = {}
+    if baseline is not None:
+        for run in baseline["runs"]:
+            previous[run["format"]] = run
+    columns = "{:>6} {:>14} {:>10} {:>14} {:>12}"
+    print(columns.format("format", "benchmark", "segments", "segments/sec", "peak KiB") + ("  vs baseline" if baseline else ""))
+    for run in report["runs"]:
+        for name, result in run["results"].items():
+            line = columns.format(run["format"], name, run["segments"], "{:.0f}".format(result["segments_per_sec"]), "{:.0f}".format(result["peak_bytes"] / 1024))
+            old = previous.get(run["format"])
+            if old is not None and old["segments"] != run["segments"]:
+                line += "  (baseline corpus differs)"
+            elif old is not None and name in old["results"]:
+                old = old["results"][name]
+                line += "  {:+.1%} speed, {:+.1%} memory".format(
+                    result["segments_per_sec"] / old["segments_per_sec"] - 1,
+                    result["peak_bytes"] / old["peak_bytes"] - 1,
+                )
+            print(line)
+    line = "import time: {:.1f} ms".format(report["import_seconds"] * 1000)
+    if baseline is not None:
+        line += "  (baseline {:.1f} ms)".format(baseline["import_seconds"] * 1000)
+    print(line)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark building and parsing synthetic interchanges")
+    parser.add_argument("--formats", nargs="+", default=["810", "850"], help="transaction set formats to benchmark")
+    parser.add_argument("--transactions", type=int, default=10, help="transaction sets per interchange")
+    parser.add_argument("--line-items", type=int, default=100, help="line item loop iterations per transaction set")
+    parser.add_argument("--n1-loops", type=int, default=2, help="N1 loop iterations per transaction set")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per benchmark; the fastest is kept")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for the synthetic corpus")
+    parser.add_argument("--json", metavar="PATH", help="write results as JSON to PATH ('-' for stdout)")
+    parser.add_argument("--compare", metavar="PATH", help="JSON results of an earlier run to compare against")
+    args = parser.parse_args(argv)
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "import_seconds": import_time(args.repeat),
+        "runs": [run_format(edi_format, args) for edi_format in args.formats],
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+    if args.json == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        print_table(report, baseline)
+        if args.json:
+            with open(args.json, "w") as output:
+                json.dump(report, output, indent=2)
+
+if __name__ == "__main__":
+    main()
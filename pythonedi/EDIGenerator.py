@@ -3,184 +3,345 @@ Parses a provided dictionary set and tries to build an EDI message from the data
 Provides hints if data is missing, incomplete, or incorrect.
 """
 
+from time import perf_counter
+
 from .supported_formats import supported_formats
+from .schema import ENVELOPE_SEGMENTS, get_schema
+from .syntax import describe_violation, find_violation, presence
+from .diagnostics import INVALID_DEFINITION, INVALID_ELEMENT, MISSING_ELEMENT, MISSING_LOOP, MISSING_SEGMENT, SYNTAX_RULE, UNSUPPORTED_TRANSACTION
 from .debug import Debug
 
+# Generation plan step kinds
+EMIT_SEGMENT = 0
+EMIT_LOOP = 1
+EMIT_FAILURE = 2
+
+_plans = {}
+
+def get_plan(edi_format, body_only=False):
+    """
+    Returns the generation plan for a compiled format, compiling it on first use.
+
+    With `body_only`, the plan covers ST up to (not including) SE, leaving the
+    envelope and SE trailer to the caller.
+    """
+    # Keyed by the schema itself, so a format replaced from another path gets a new plan
+    key = (edi_format, body_only)
+    plan = _plans.get(key)
+    if plan is None:
+        sections = edi_format.sections
+        if body_only:
+            sections = [section for section in sections if section.id not in ENVELOPE_SEGMENTS and section.id != "SE"]
+        plan = compile_plan(sections, edi_format.name)
+        _plans[key] = plan
+    return plan
+
+def compile_plan(sections, ts_id, loop=None):
+    """
+    Compiles a list of sections (a transaction set, or one iteration of
+    `loop`) into an ordered list of emit steps:
+    `(kind, section_id, section, on_missing, payload)`.
+
+    `on_missing` is None when the section may be left out, or the arguments
+    for `EDIGenerator.fail` when it is mandatory. For loops, `payload` is the
+    plan for one iteration (or, for an invalid loop definition, the arguments
+    for `EDIGenerator.fail`).
+    """
+    steps = []
+    for section in sections:
+        # Decide now what a missing section means
+        if section.type == "loop" and loop is None:
+            mandatory = [segment for segment in section.segments if segment.req == "M"]
+            if len(mandatory) > 0:
+                on_missing = (MISSING_LOOP, section, "EDI data is missing loop {} with mandatory segment(s) {}".format(section.id, ", ".join([segment.id for segment in mandatory])), None, section.definition)
+            else:
+                # No mandatory segments in loop
+                on_missing = None
+        elif section.req == "O":
+            on_missing = None
+        elif section.req == "M":
+            if loop is None:
+                on_missing = (MISSING_SEGMENT, section, "EDI data is missing mandatory segment '{}'.".format(section.id), None, section.definition)
+            else:
+                on_missing = (MISSING_SEGMENT, section, "EDI data in loop '{}' is missing mandatory segment '{}'.".format(loop.id, section.id), None, loop.definition)
+        else:
+            on_missing = (INVALID_DEFINITION, section, "Unknown 'req' value '{}' when processing format for segment '{}' in set '{}'".format(section.req, section.id, ts_id), None, None)
+
+        if section.type == "segment":
+            steps.append((EMIT_SEGMENT, section.id, section, on_missing, None))
+        elif len(section.segments) > section.repeat:
+            # Verify loop length
+            steps.append((EMIT_FAILURE, section.id, section, on_missing, (INVALID_DEFINITION, section, "Loop '{}' has {} segments (max {})".format(section.id, len(section.segments), section.repeat), None, None)))
+        else:
+            steps.append((EMIT_LOOP, section.id, section, on_missing, compile_plan(section.segments, ts_id, section)))
+    return steps
+
 class EDIGenerator(object):
-    def __init__(self):
+    def __init__(self, stats=None, diagnostics=None):
         # Set default delimiters
         self.element_delimiter = "^"
         self.segment_delimiter = "\n"
         self.data_delimiter = "`"
 
+        # Per-segment counters and timings are collected into a Stats object
+        # (pass stats=True for a new one)
+        if stats is True:
+            from .stats import Stats
+            stats = Stats()
+        self.stats = stats
+        if self.stats is not None:
+            self.build_segment = self.timed_build_segment
+        # With a Diagnostics collector, build errors are recorded there
+        # instead of explained on the terminal before they are raised
+        self.diagnostics = diagnostics
+
     def build(self, data):
         """
         Compiles a transaction set (as a dict) into an EDI message
         """
+        return self.segment_delimiter.join(self.iter_segments(data))
+
+    def build_to(self, data, stream):
+        """
+        Compiles a transaction set (as a dict) into an EDI message, writing
+        each segment to the text stream `stream` as soon as it is built.
+
+        Returns the number of segments written.
+        """
+        count = 0
+        for segment in self.iter_segments(data):
+            if count:
+                stream.write(self.segment_delimiter)
+            stream.write(segment)
+            count += 1
+        return count
+
+    def iter_segments(self, data):
+        """
+        Yields each segment of the EDI message for a transaction set (as a dict)
+        as it is built. Loop data may be any iterable, such as a generator over
+        database rows, so only one loop iteration needs to be in memory at a time.
+        """
+        ts_id, edi_format = self.transaction_format(data)
+
+        # Run the format's precompiled generation plan over the data
+        return self.run_plan(get_plan(edi_format), data)
+
+    def build_batch(self, isa, gs, transactions, first_control_number=1):
+        """
+        Compiles many transaction sets (as dicts) into one interchange with a
+        single functional group. See `iter_batch_segments`.
+        """
+        return self.segment_delimiter.join(self.iter_batch_segments(isa, gs, transactions, first_control_number))
+
+    def build_batch_to(self, isa, gs, transactions, stream, first_control_number=1):
+        """
+        Writes an interchange built by `iter_batch_segments` to the text stream
+        `stream`, one segment at a time. Returns the number of segments written.
+        """
+        count = 0
+        for segment in self.iter_batch_segments(isa, gs, transactions, first_control_number):
+            if count:
+                stream.write(self.segment_delimiter)
+            stream.write(segment)
+            count += 1
+        return count
+
+    def iter_batch_segments(self, isa, gs, transactions, first_control_number=1):
+        """
+        Yields the segments of one interchange wrapping every transaction set in
+        `transactions` in a single ISA/GS envelope, in one pass.
+
+        `isa` and `gs` are the ISA and GS element lists. Transaction dicts hold
+        their ST through the last segment before SE. ST02 control numbers that
+        are left out are assigned sequentially from `first_control_number`. The
+        SE, GE and IEA trailers are generated, with their segment and
+        transaction counts and their matching control numbers.
+        """
+        return self.iter_envelope_segments(isa, gs, transactions, self.batch_body, first_control_number)
+
+    def build_acknowledgments(self, isa, gs, groups, first_control_number=1):
+        """
+        Compiles a 997 for each `GroupAcknowledgment` in `groups` into one
+        interchange. See `iter_acknowledgment_segments`.
+        """
+        return self.segment_delimiter.join(self.iter_acknowledgment_segments(isa, gs, groups, first_control_number))
+
+    def iter_acknowledgment_segments(self, isa, gs, groups, first_control_number=1):
+        """
+        Yields the segments of one interchange holding a 997 functional
+        acknowledgment for each `GroupAcknowledgment` in `groups` (e.g. the
+        `groups` of an `Acknowledgments` collector after parsing), in a single
+        ISA/GS envelope. `gs` is the GS element list of the acknowledgment
+        group itself, with GS01 "FA". The 997s are numbered from
+        `first_control_number` and written straight from the acceptance state.
+        Groups of transaction sets that arrived outside any GS are left out.
+        """
+        groups = (group for group in groups if group.functional_id is not None)
+        return self.iter_envelope_segments(isa, gs, groups, self.acknowledgment_body, first_control_number)
+
+    def iter_envelope_segments(self, isa, gs, items, body, first_control_number=1):
+        """
+        Yields one interchange with a single functional group, holding a
+        transaction set for each of `items`. `body(item, control_number)`
+        returns `(edi_format, control_number, segments)`, the segments running
+        from ST up to (not including) SE; the SE, GE and IEA trailers are
+        generated here.
+        """
+        envelope = get_schema("envelope").paths
+        yield self.build_segment(envelope["envelope/ISA"], isa)
+        yield self.build_segment(envelope["envelope/GS"], gs)
+
+        transaction_count = 0
+        for control_number, item in enumerate(items, first_control_number):
+            edi_format, control_number, segments = body(item, control_number)
+            segment_count = 0
+            for segment in segments:
+                segment_count += 1
+                yield segment
+            # SE01 counts every segment from ST through SE
+            yield self.build_segment(edi_format.paths[edi_format.name + "/SE"], [segment_count + 1, control_number])
+            transaction_count += 1
+
+        yield self.build_segment(envelope["envelope/GE"], [transaction_count, gs[5]])
+        yield self.build_segment(envelope["envelope/IEA"], [1, isa[12]])
+
+    def batch_body(self, transaction, control_number):
+        """ Body of a transaction set dict in a batch, numbered `control_number` unless its ST02 is set """
+        ts_id, edi_format = self.transaction_format(transaction)
+        header = list(transaction["ST"])
+        if len(header) < 2 or header[1] is None:
+            header[1:2] = ["{:04d}".format(control_number)]
+        transaction = dict(transaction, ST=header)
+        return edi_format, header[1], self.run_plan(get_plan(edi_format, body_only=True), transaction)
+
+    def acknowledgment_body(self, group, control_number):
+        """ Body of the 997 acknowledging a `GroupAcknowledgment` """
+        edi_format = get_schema("997")
+        control_number = "{:04d}".format(control_number)
+        return edi_format, control_number, self.iter_acknowledgment_body(edi_format.paths, group, control_number)
+
+    def iter_acknowledgment_body(self, paths, group, control_number):
+        yield self.build_segment(paths["997/ST"], ["997", control_number])
+        for path, elements in group.segments():
+            yield self.build_segment(paths["997/" + path], elements)
+
+    def transaction_format(self, data):
+        """
+        Returns the transaction set ID and compiled format for a transaction set (as a dict)
+        """
         # Check for transaction set ID in data
 
         if "ST" not in data:
-            Debug.explain(supported_formats["ST"])
+            if self.diagnostics is not None:
+                self.diagnostics.add(MISSING_SEGMENT, segment_id="ST")
+            else:
+                Debug.explain(supported_formats["ST"])
             raise ValueError("No transaction set header found in data.")
         ts_id = data["ST"][0]
         if ts_id not in supported_formats:
+            if self.diagnostics is not None:
+                self.diagnostics.add(UNSUPPORTED_TRANSACTION, segment_id="ST", detail=ts_id)
             raise ValueError("Transaction set type '{}' is not supported. Valid types include: {}".format(
                 ts_id,
                 "".join(["\n - " + f for f in supported_formats])
             ))
-        edi_format = supported_formats[ts_id]
-
-        output_segments = []
-
-        # Walk through the format definition to compile the output message
-        for section in edi_format:
-            if section["type"] == "segment":
-                if section["id"] not in data:
-                    if section["req"] == "O":
-                        # Optional segment is missing - that's fine, keep going
-                        continue
-                    elif section["req"] == "M":
-                        # Mandatory segment is missing - explain it and then fail
-                        Debug.explain(section)
-                        raise ValueError("EDI data is missing mandatory segment '{}'.".format(section["id"]))
-                    else:
-                        raise ValueError("Unknown 'req' value '{}' when processing format for segment '{}' in set '{}'".format(section["req"], section["id"], ts_id))
-                output_segments.append(self.build_segment(section, data[section["id"]]))
-            elif section["type"] == "loop":
-                if section["id"] not in data:
-                    mandatory = [segment for segment in section["segments"] if segment["req"] == "M"]
-                    if len(mandatory) > 0:
-                        Debug.explain(section)
-                        raise ValueError("EDI data is missing loop {} with mandatory segment(s) {}".format(section["id"], ", ".join([segment["id"] for segment in mandatory])))
-                    else:
-                        # No mandatory segments in loop - continue
-                        continue
-                # Verify loop length
-                if len(section["segments"]) > section["repeat"]:
-                    raise ValueError("Loop '{}' has {} segments (max {})".format(section["id"], len(section["segments"]), section["repeat"]))
-                # Iterate through and build segments in loop
-                for iteration in data[section["id"]]:
-                    for segment in section["segments"]:
-                        if segment["id"] not in iteration:
-                            if segment["req"] == "O":
-                                # Optional segment is missing - that's fine, keep going
-                                continue
-                            elif segment["req"] == "M":
-                                # Mandatory segment is missing - explain loop and then fail
-                                Debug.explain(section)
-                                raise ValueError("EDI data in loop '{}' is missing mandatory segment '{}'.".format(section["id"], segment["id"]))
-                            else:
-                                raise ValueError("Unknown 'req' value '{}' when processing format for segment '{}' in set '{}'".format(segment["req"], segment["id"], ts_id))
-                        output_segments.append(self.build_segment(segment, iteration[segment["id"]]))
-
-        return self.segment_delimiter.join(output_segments)
+        return ts_id, get_schema(ts_id)
+
+    def run_plan(self, steps, data):
+        """
+        Yields the segments built from `data` by a compiled generation plan
+        """
+        build_segment = self.build_segment
+        stats = self.stats
+        for kind, section_id, section, on_missing, payload in steps:
+            if section_id not in data:
+                if on_missing is None:
+                    # Optional section is missing - that's fine, keep going
+                    continue
+                self.fail(*on_missing)
+            if kind == EMIT_SEGMENT:
+                yield build_segment(section, data[section_id])
+            elif kind == EMIT_LOOP:
+                # Iterate through and build segments in loop, one iteration at a time
+                for iteration in data[section_id]:
+                    if stats is not None:
+                        stats.record_loop(section)
+                    yield from self.run_plan(payload, iteration)
+            else:
+                self.fail(*payload)
+
+    def fail(self, code, section, message, element_id=None, explain=None, detail=None):
+        """ Records a build error in `diagnostics` (or explains the `explain`
+        definition, without one) and raises it """
+        if self.diagnostics is not None:
+            self.diagnostics.add(code, None, section.id, element_id, section.path, detail)
+        elif explain is not None:
+            Debug.explain(explain)
+        raise ValueError(message)
+
+    def timed_build_segment(self, segment, segment_data):
+        """ build_segment, recording the segment in `stats` """
+        start = perf_counter()
+        output = type(self).build_segment(self, segment, segment_data)
+        self.stats.record_segment(segment, len(output) + len(self.segment_delimiter), perf_counter() - start)
+        return output
 
     def build_segment(self, segment, segment_data):
-        # Parse segment elements
-        output_elements = [segment["id"]]
-        for e_data, e_format, index in zip(segment_data, segment["elements"], range(len(segment["elements"]))):
-            output_elements.append(self.build_element(e_format, e_data))
-        
+        # Parse segment elements with their precompiled formatters
+        output_elements = [segment.id]
+        append = output_elements.append
+        for e_data, (e_format, req, format_element, min_length, max_length, separator) in zip(segment_data, segment.element_formatters):
+            if e_data is None:
+                if req == "O":
+                    append("")
+                elif req == "M":
+                    self.fail(MISSING_ELEMENT, segment, "Element {} ({}) is mandatory".format(e_format.id, e_format.name), e_format.id)
+                else:
+                    self.fail(INVALID_DEFINITION, segment, "Unknown 'req' value '{}' when processing format for element '{}'".format(req, e_format.id), e_format.id, detail=req)
+                continue
+            try:
+                formatted_element = format_element(e_data)
+                if separator:
+                    # Component Element Separator
+                    self.data_delimiter = formatted_element[0]
+            except:
+                self.fail(INVALID_ELEMENT, segment, "Error converting '{}' to data type '{}'".format(e_data, e_format.data_type), e_format.id, detail=e_format.data_type)
+            # Pad/trim formatted element to fit the field min/max length respectively
+            if len(formatted_element) < min_length:
+                formatted_element += " "*(min_length-len(formatted_element))
+            append(formatted_element[:max_length])
+
         # End of segment. If segment has syntax rules, validate them.
-        if "syntax" in segment:
-            for rule in segment["syntax"]:
-                # Note that the criteria indexes are one-based 
-                # rather than zero-based. However, the output_elements
-                # array is prepopulated with the segment name,
-                # so the net offset works perfectly!
-                if rule["rule"] == "ATLEASTONE": # At least one of the elements in `criteria` must be present
-                    found = False
-                    for idx in rule["criteria"]:
-                        if idx >= len(output_elements):
-                            break
-                        elif output_elements[idx] != "":
-                            found = True
-                    if found is False:
-                        # None of the elements were found
-                        required_elements = ", ".join(["{}{:02d}".format(segment["id"], e) for e in rule["criteria"]])
-                        Debug.explain(segment)
-                        raise ValueError("Syntax error parsing segment {}: At least one of {} is required.".format(segment["id"], required_elements))
-                elif rule["rule"] == "ALLORNONE": # Either all the elements in `criteria` must be present, or none of them may be
-                    found = 0
-                    for idx in rule["criteria"]:
-                        if idx >= len(output_elements):
-                            break
-                        elif output_elements[idx] != "":
-                            found += 1
-                    if 0 < found < len(rule["criteria"]):
-                        # Some but not all the elements are present
-                        required_elements = ", ".join(["{}{:02d}".format(segment["id"], e) for e in rule["criteria"]])
-                        Debug.explain(segment)
-                        raise ValueError("Syntax error parsing segment {}: If one of {} is present, all are required.".format(segment["id"], required_elements))
-                elif rule["rule"] == "IFATLEASTONE": # If the first element in `criteria` is present, at least one of the others must be
-                    found = 0
-                    # Check if first element exists and is set
-                    if rule["criteria"][0] < len(output_elements) and output_elements[rule["criteria"][0]] != "":
-                        for idx in rule["criteria"][1:]:
-                            if idx >= len(output_elements):
-                                break
-                            elif output_elements[idx] != "":
-                                found += 1
-                        if 0 < found < len(rule["criteria"]):
-                            # Some but not all the elements are present
-                            first_element = "{}{:02d}".format(segment["id"], rule["criteria"][0])
-                            required_elements = ", ".join(["{}{:02d}".format(segment["id"], e) for e in rule["criteria"][0]])
-                            Debug.explain(segment)
-                            raise ValueError("Syntax error parsing segment {}: If {} is present, at least one of {} are required.".format(segment["id"], first_element, required_elements))
-            
+        if segment.syntax_rules:
+            rule = find_violation(segment.syntax_rules, presence(output_elements))
+            if rule is not None:
+                element_id = "{}{:02d}".format(segment.id, rule["criteria"][0])
+                self.fail(SYNTAX_RULE, segment, describe_violation(segment.id, rule), element_id, segment.definition, rule["rule"])
+
         return self.element_delimiter.join(output_elements)
 
     def build_element(self, e_format, e_data):
-        element_id = e_format["id"]
-        formatted_element = ""
+        element_id = e_format.id
         if e_data is None:
-            if e_format["req"] == "M":
-                raise ValueError("Element {} ({}) is mandatory".format(element_id, e_format["name"]))
-            elif e_format["req"] == "O":
+            if e_format.req == "M":
+                raise ValueError("Element {} ({}) is mandatory".format(element_id, e_format.name))
+            elif e_format.req == "O":
                 return ""
             else:
-                raise ValueError("Unknown 'req' value '{}' when processing format for element '{}' in set '{}'".format(e_format["req"], element_id, ts_id))
+                raise ValueError("Unknown 'req' value '{}' when processing format for element '{}'".format(e_format.req, element_id))
         try:
-            if e_format["data_type"] == "AN":
-                formatted_element = str(e_data)
-            elif e_format["data_type"] == "DT":
-                if e_format["length"]["max"] == 8:
-                    formatted_element = e_data.strftime("%Y%m%d")
-                elif e_format["length"]["max"] == 6:
-                    formatted_element = e_data.strftime("%y%m%d")
-                else:
-                    raise ValueError("Invalid length ({}) for date field in element '{}' in set '{}'".format(e_format["length"], element_id, ts_id))
-            elif e_format["data_type"] == "TM":
-                if e_format["length"]["max"] in (4, 6, 7, 8):
-                    #formatted_element = e_data.strftime("%H%M%S%f")
-                    formatted_element = e_data.strftime("%H%M")
-                else:
-                    raise ValueError("Invalid length ({}) for time field in element '{}' in set '{}'".format(e_format["length"], element_id, ts_id))
-            elif e_format["data_type"] == "R":
-                formatted_element = str(float(e_data))
-            elif e_format["data_type"].startswith("N"):
-                formatted_element = "{:0{length}.{decimal}f}".format(float(e_data), length=e_format["length"]["min"], decimal=e_format["data_type"][1:])
-            elif e_format["data_type"] == "ID":
-                formatted_element = str(e_data)
-                if not e_format["data_type_ids"]:
-                    #Debug.log_warning("No valid IDs provided for element '{}'. Allowing anyway.".format(e_format["name"]))
-                    pass
-                elif e_data not in e_format["data_type_ids"]:
-                    #Debug.log_warning("ID '{}' not recognized for element '{}'. Allowing anyway.".format(e_data, e_format["name"]))
-                    pass
-            elif e_format["data_type"] == "":
-                if element_id == "ISA16":
-                    # Component Element Separator
-                    self.data_delimiter = str(e_data)[0]
-                    formatted_element = str(e_data)
-                else:
-                    raise ValueError("Undefined behavior for empty data type with element '{}'".format(element_id))
+            # Each element carries its own precompiled formatter
+            formatted_element = e_format.format(e_data)
+            if element_id == "ISA16":
+                # Component Element Separator
+                self.data_delimiter = formatted_element[0]
         except:
-            raise ValueError("Error converting '{}' to data type '{}'".format(e_data, e_format["data_type"]))
+            raise ValueError("Error converting '{}' to data type '{}'".format(e_data, e_format.data_type))
 
         # Pad/trim formatted element to fit the field min/max length respectively
-        formatted_element += " "*(e_format["length"]["min"]-len(formatted_element))
-        formatted_element = formatted_element[:e_format["length"]["max"]]
+        formatted_element += " "*(e_format.min_length-len(formatted_element))
+        formatted_element = formatted_element[:e_format.max_length]
 
         # Add element to list
-        return formatted_element
\ No newline at end of file
+        return formatted_element
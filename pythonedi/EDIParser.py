@@ -3,164 +3,849 @@ Parses a provided EDI message and tries to build a dictionary from the data
 Provides hints if data is missing, incomplete, or incorrect.
 """
 
-import datetime
+import mmap
+import os
+from time import perf_counter
 
 from .supported_formats import supported_formats
+from .schema import ENVELOPE_SEGMENTS, find_section, get_schema, install_schemas, skipped_paths
+from .syntax import check_syntax, iter_violations, presence
+from .diagnostics import (INVALID_ELEMENT, MISSING_ELEMENT, MISSING_LOOP, MISSING_SEGMENT, OUTSIDE_TRANSACTION, SYNTAX_RULE,
+                          TOO_MANY_ELEMENTS, UNRECOGNIZED_SEGMENT, UNSUPPORTED_TRANSACTION, invalid_element)
 from .debug import Debug
 
-class EDIParser(object):
-    def __init__(self, edi_format=None, element_delimiter="^", segment_delimiter="\n", data_delimiter="`"):
-        # Set default delimiters
+# Feature modules are imported on first use, keeping `import pythonedi` cheap;
+# lazy_segment binds this one the first time it builds a view
+LazySegment = None
+
+DEFAULT_DELIMITERS = ("^", "\n", "`")
+
+def detect_delimiters(data):
+    """ Reads the delimiters from the ISA header at the start of `data`.
+
+    Returns `(element_delimiter, segment_delimiter, data_delimiter)`, or None if
+    `data` does not start with a complete ISA header. A line break following the
+    segment terminator is treated as part of the terminator. """
+    header = data[:256].lstrip()
+    if not header.startswith("ISA") or len(header) < 4:
+        return None
+    element_delimiter = header[3]
+    # ISA16 is a single character, immediately followed by the segment terminator
+    fields = header.split(element_delimiter, 16)
+    if len(fields) < 17 or len(fields[16]) < 2:
+        return None
+    data_delimiter = fields[16][0]
+    segment_delimiter = fields[16][1]
+    line_break = fields[16][2:4]
+    if segment_delimiter == "\r" and line_break.startswith("\n"):
+        segment_delimiter = "\r\n"
+    elif segment_delimiter not in "\r\n":
+        if line_break == "\r\n":
+            segment_delimiter += "\r\n"
+        elif line_break.startswith("\n"):
+            segment_delimiter += "\n"
+    return element_delimiter, segment_delimiter, data_delimiter
+
+# Parser used by each parse_many worker process
+_worker_parser = None
+
+def _init_worker(settings, schemas):
+    """ Installs the parent's compiled formats and a parser with its settings in a worker process """
+    global _worker_parser
+    install_schemas(schemas)
+    _worker_parser = EDIParser(**settings)
+
+def _parse_chunk(items):
+    """ Parses a chunk of parse_many inputs in a worker process """
+    return [_worker_parser.parse_item(item) for item in items]
+
+class SegmentCursor(object):
+    """ Forward-only read position into a sequence of segments.
+
+    A single cursor is shared by every level of the parser, so nested loops
+    consume segments in place instead of slicing off the rest of the message.
+    `current` is the raw text of the segment under the cursor and `name` its
+    segment ID; the elements are only split once the segment is parsed.
+
+    The cursor also carries the delimiters of the message it reads, so a
+    generator left open over one message is unaffected by the parser
+    detecting other delimiters in the next. """
+
+    def __init__(self, segments, element_delimiter, segment_delimiter=DEFAULT_DELIMITERS[1], data_delimiter=DEFAULT_DELIMITERS[2]):
+        self._segments = iter(segments)
         self.element_delimiter = element_delimiter
         self.segment_delimiter = segment_delimiter
         self.data_delimiter = data_delimiter
+        self.position = -1
+        self.current = None
+        self.name = None
+        self.advance()
+
+    def advance(self):
+        """ Moves to the next segment; `current` is None once the input is exhausted """
+        segment = next(self._segments, None)
+        self.current = segment
+        self.position += 1
+        if segment is not None:
+            end = segment.find(self.element_delimiter)
+            self.name = segment if end < 0 else segment[:end]
 
-        # Set EDI format to use
+class EDIParser(object):
+    def __init__(self, edi_format=None, element_delimiter=None, segment_delimiter=None, data_delimiter=None, lazy=False, records=False, validate=False, stats=None, cache=None, diagnostics=None, acknowledgments=None):
+        # Delimiters left as None are read from each message's ISA header
+        self.delimiters = (element_delimiter, segment_delimiter, data_delimiter)
+        self.element_delimiter, self.segment_delimiter, self.data_delimiter = [
+            default if configured is None else configured
+            for configured, default in zip(self.delimiters, DEFAULT_DELIMITERS)
+        ]
+
+        # Set EDI format to use. Without one, each transaction set is routed
+        # to the supported format named by its ST01 element.
         if edi_format in supported_formats:
-            self.edi_format = supported_formats[edi_format]
+            self.edi_format = get_schema(edi_format)
         elif edi_format is None:
             self.edi_format = None
         else:
             raise ValueError("Unsupported EDI format {}".format(edi_format))
 
-    def parse(self, data):
+        # In lazy mode segments are returned as views that only split and
+        # convert their elements when accessed
+        self.lazy = lazy
+        # In records mode segments and loop iterations are returned as
+        # generated __slots__ records instead of dicts
+        self.records = records
+        if lazy and records:
+            raise ValueError("Lazy and records output modes cannot be combined")
+        self.record_builder = None
+        # With validate, each segment is checked against its syntax rules
+        # (ATLEASTONE, ALLORNONE, IFATLEASTONE) as it is parsed
+        self.validate = validate
+        # Per-segment counters and timings are collected into a Stats object
+        # (pass stats=True for a new one). Without one, none of the
+        # instrumented methods below are used.
+        if stats is True:
+            from .stats import Stats
+            stats = Stats()
+        self.stats = stats
+        if self.stats is not None:
+            self.build_segment = self.timed_build_segment
+            self.build_loop = self.counted_build_loop
+        # With a ParseCache, messages already seen with the same settings are
+        # returned from the cache by parse and parse_file (except while stats,
+        # diagnostics or acknowledgments are collected, which needs every
+        # message walked)
+        self.cache = cache
+        # With a Diagnostics collector, problems are recorded there instead of
+        # printed, and parsing carries on past the ones it can
+        self.diagnostics = diagnostics
+        # An Acknowledgments collector tracks the acceptance of every GS and
+        # ST parsed. It is a Diagnostics collector too, and needs to see every
+        # problem, so it takes that role. While it is attached, mandatory
+        # segments and elements are checked too, and a bad element is
+        # recorded instead of ending the parse, so every transaction set in
+        # the input gets its acknowledgment.
+        if acknowledgments is not None:
+            if diagnostics is not None and diagnostics is not acknowledgments:
+                raise ValueError("Acknowledgments collect diagnostics themselves; pass one or the other")
+            self.diagnostics = acknowledgments
+        self.acknowledgments = acknowledgments
+        self.cursor = None
+        # Paths of the sections left out of the current parse (see `select`)
+        self.selection = None
+        self.skipped = frozenset()
+
+    def set_delimiters(self, header):
+        """ Applies the configured delimiters, reading any unset ones from the
+        ISA header in `header`. Returns `(element_delimiter, segment_delimiter, data_delimiter)`. """
+        detected = detect_delimiters(header) or DEFAULT_DELIMITERS
+        self.element_delimiter, self.segment_delimiter, self.data_delimiter = delimiters = tuple(
+            found if configured is None else configured
+            for configured, found in zip(self.delimiters, detected)
+        )
+        return delimiters
+
+    def open_cursor(self, data, chunk_size=65536, encoding="utf-8"):
+        """ Returns a cursor over the segments of `data`: a string, a text
+        file-like object, or a memory-mapped file in `encoding` """
+        if self.records:
+            from .records import RecordBuilder
+            # ID codes are interned across everything parsed from this input
+            self.record_builder = RecordBuilder(self.invalid_element)
+        if isinstance(data, mmap.mmap):
+            self.set_delimiters(data[:256].decode(encoding, "replace"))
+            segments = self.map_segments(data, encoding)
+        elif hasattr(data, "read"):
+            segments = self.read_segments(data, chunk_size)
+        else:
+            self.set_delimiters(data)
+            segments = self.split_segments(data)
+        self.cursor = SegmentCursor(segments, self.element_delimiter, self.segment_delimiter, self.data_delimiter)
+        return self.cursor
+
+    def parse(self, data, include=None, exclude=None):
         """ Processes each line in the string `data`, attempting to auto-detect the EDI type.
 
-        Returns the parsed message as a dict. """
+        Returns the parsed message as a dict. `include` and `exclude` limit
+        the result to (or leave out) the segments and loops they name, by ID
+        ("N1", "L_N1") or path ("L_IT1/L_PID"). Sections left out are only
+        scanned for their extent, never split into elements. """
+        self.select(include, exclude)
+        try:
+            if self.cache is not None and self.stats is None and self.diagnostics is None and not hasattr(data, "read"):
+                return self.parse_cached(data)
+            # Break the message up into chunks, splitting each segment exactly once
+            return self.collect_sections(self.open_cursor(data))
+        finally:
+            self.select(None, None)
+
+    def select(self, include=None, exclude=None):
+        """ Limits the sections parsed to those named by `include`, leaving out
+        those named by `exclude` (both None to parse everything) """
+        if include is None and exclude is None:
+            self.selection = None
+            self.skipped = frozenset()
+            return
+        self.selection = (None if include is None else tuple(include), None if exclude is None else tuple(exclude))
+        self.skipped = set()
+        self.selected_formats = set()
+        if self.edi_format is not None:
+            self.select_format(self.edi_format)
 
-        # Break the message up into chunks
-        edi_segments = data.split(self.segment_delimiter)
+    def select_format(self, edi_format):
+        """ Adds the sections of a compiled format left out by the current selection """
+        if edi_format.name not in self.selected_formats:
+            include, exclude = self.selection
+            self.skipped.update(skipped_paths(edi_format, include, exclude))
+            self.selected_formats.add(edi_format.name)
 
-        # Eventually, find the ST header and parse the EDI format
-        if self.edi_format is None:
-            raise NotImplementedError("EDI format autodetection not built yet. Please specify an EDI format.")
+    def parse_cached(self, data, encoding="utf-8"):
+        """ Returns the parse result for `data` from the cache, parsing and storing it on a miss """
+        # Results depend on the definitions as well as their names: without a
+        # fixed format, any supported format may be used
+        edi_formats = (self.edi_format,) if self.edi_format is not None else map(get_schema, sorted(supported_formats))
+        formats = tuple((edi_format.name, edi_format.digest) for edi_format in edi_formats)
+        settings = (formats, self.delimiters, self.lazy, self.records, self.validate, self.selection, encoding)
+        key = self.cache.key(data, settings)
+        cached = self.cache.get(key)
+        if cached is not None:
+            # Leave the parser as the parse would have: delimiters read from this message
+            delimiters, result = cached
+            self.element_delimiter, self.segment_delimiter, self.data_delimiter = delimiters
+            return result
+        cursor = self.open_cursor(data, encoding=encoding)
+        result = self.collect_sections(cursor)
+        self.cache.put(key, ((cursor.element_delimiter, cursor.segment_delimiter, cursor.data_delimiter), result))
+        return result
 
+    def parse_file(self, path, encoding="utf-8", include=None, exclude=None):
+        """ Parses the EDI file at `path` without reading it into one string.
+
+        The file is memory-mapped and segment terminators are found at the
+        byte level; each segment is decoded on its own as the parser reaches
+        it, so the file is never held as a full string plus a list of every
+        segment. Returns the same result as `parse`. """
+        with open(path, "rb") as edi_file:
+            if os.fstat(edi_file.fileno()).st_size == 0:
+                return self.parse("", include, exclude)
+            with mmap.mmap(edi_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                self.select(include, exclude)
+                try:
+                    if self.cache is not None and self.stats is None and self.diagnostics is None:
+                        return self.parse_cached(mapped, encoding)
+                    return self.collect_sections(self.open_cursor(mapped, encoding=encoding))
+                finally:
+                    self.select(None, None)
+
+    def collect_sections(self, cursor):
+        """ Parses every top-level section from the cursor into `(found_segments, dict)` """
         to_return = {}
         found_segments = []
-        
-        while len(edi_segments) > 0:
-            segment = edi_segments[0]
+
+        for segment_name, segment_obj in self.iter_sections(cursor):
+            found_segments.append(segment_name)
+            to_return[segment_name] = segment_obj
+
+        return found_segments, to_return
+
+    def parse_item(self, item):
+        """ Parses one parse_many input: a path to an EDI file, or the message itself """
+        if isinstance(item, bytes):
+            item = item.decode("utf-8")
+        elif isinstance(item, os.PathLike) or os.path.isfile(item):
+            with open(item, "r") as edi_file:
+                item = edi_file.read()
+        return self.parse(item)
+
+    def parse_many(self, items, workers=None, ordered=True, chunksize=16):
+        """ Parses many EDI messages across a pool of `workers` processes.
+
+        Each item is a file path (str or path-like) or a message (str that is
+        not a file path, or bytes). Items are sent to the workers `chunksize`
+        at a time, and each worker starts with this parser's compiled formats
+        instead of loading them again. Yields each `parse` result in input
+        order, or `(index, result)` pairs as they complete if `ordered` is
+        False. With fewer than two workers, items are parsed in this process.
+
+        `items` may be any iterable, including a generator. Only twice as
+        many chunks as there are workers are read ahead of the results
+        yielded, so neither all the inputs nor all the results are held at once.
+
+        Workers get this parser's settings (see `worker_settings`), not the
+        parser itself. Stats, diagnostics and acknowledgments would be
+        collected in the workers and lost, so parsers with any of them
+        attached are rejected when workers are used. """
+        items = iter(items)
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if workers < 2:
+            for index, item in enumerate(items):
+                result = self.parse_item(item)
+                yield result if ordered else (index, result)
+            return
+
+        if self.stats is not None or self.diagnostics is not None or self.acknowledgments is not None:
+            raise ValueError("Stats, diagnostics and acknowledgments cannot be collected from parse_many workers")
+        from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+        from itertools import islice
+
+        # Compile everything up front: forked workers inherit it, others receive it once
+        if self.edi_format is not None:
+            schemas = {self.edi_format.name: self.edi_format}
+        else:
+            schemas = {format_name: get_schema(format_name) for format_name in supported_formats}
+        window = workers * 2
+        # Chunks submitted and not yet yielded, in submission order, mapped to the index of their first item
+        pending = {}
+        start = 0
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(self.worker_settings(), schemas)) as pool:
+            while True:
+                while len(pending) < window:
+                    chunk = list(islice(items, chunksize))
+                    if not chunk:
+                        break
+                    pending[pool.submit(_parse_chunk, chunk)] = start
+                    start += len(chunk)
+                if not pending:
+                    break
+                if ordered:
+                    future = next(iter(pending))
+                else:
+                    future = next(iter(wait(pending, return_when=FIRST_COMPLETED).done))
+                for index, result in enumerate(future.result(), pending.pop(future)):
+                    yield result if ordered else (index, result)
+
+    def worker_settings(self):
+        """ Constructor arguments recreating this parser's settings in a parse_many worker """
+        element_delimiter, segment_delimiter, data_delimiter = self.delimiters
+        return {
+            "edi_format": self.edi_format and self.edi_format.name,
+            "element_delimiter": element_delimiter,
+            "segment_delimiter": segment_delimiter,
+            "data_delimiter": data_delimiter,
+            "lazy": self.lazy,
+            "records": self.records,
+            "validate": self.validate,
+            # Each worker starts with an empty memory tier; a directory tier is shared
+            "cache": self.cache and self.cache.empty_copy(),
+        }
+
+    def iter_parse(self, fileobj, chunk_size=65536):
+        """ Streams the EDI message from the text file-like object `fileobj`.
+
+        Reads `chunk_size` characters at a time and yields a
+        `(segment_name, segment_obj)` pair for each top-level segment, repeating
+        segment or loop as soon as it is complete, so only the section being
+        parsed is held in memory. """
+        return self.iter_sections(self.open_cursor(fileobj, chunk_size))
+
+    def parse_batch(self, data):
+        """ Parses every interchange, functional group and transaction set in `data` in one pass.
+
+        Returns a list of interchanges, keeping the ISA > GS > ST hierarchy:
+        `[{"ISA": {...}, "groups": [{"GS": {...}, "transactions": [{...}], "GE": {...}}], "IEA": {...}}]`
+        where each transaction is a dict of its ST through SE sections, as returned by `parse`. """
+        interchanges = []
+        for _ in self.iter_transactions(data, interchanges=interchanges):
+            pass
+        return interchanges
+
+    def iter_transactions(self, data, chunk_size=65536, interchanges=None):
+        """ Yields `(interchange, group, transaction)` for every transaction set in `data`.
+
+        `data` may be a string or a text file-like object, which is streamed in
+        `chunk_size` reads. `interchange` and `group` are the enclosing envelope
+        dicts; their "IEA"/"GE" trailers are filled in once they are reached.
+        If an `interchanges` list is provided, the full hierarchy is collected into it. """
+        cursor = self.open_cursor(data, chunk_size)
+        interchange = None
+        group = None
+        transaction = None
+        for segment_name, segment_obj in self.iter_sections(cursor):
+            if segment_name == "ISA":
+                if transaction is not None:
+                    yield interchange, group, transaction
+                    transaction = None
+                interchange = self._new_envelope({"ISA": segment_obj}, "groups", interchanges)
+                group = None
+            elif segment_name == "GS":
+                if transaction is not None:
+                    yield interchange, group, transaction
+                    transaction = None
+                if interchange is None:
+                    interchange = self._new_envelope({}, "groups", interchanges)
+                group = self._new_envelope({"GS": segment_obj}, "transactions", interchange.get("groups"))
+            elif segment_name == "ST":
+                if transaction is not None:
+                    # Previous transaction set was never closed with an SE
+                    yield interchange, group, transaction
+                if interchange is None:
+                    interchange = self._new_envelope({}, "groups", interchanges)
+                if group is None:
+                    group = self._new_envelope({}, "transactions", interchange.get("groups"))
+                transaction = {"ST": segment_obj}
+                if interchanges is not None:
+                    group["transactions"].append(transaction)
+            elif segment_name == "GE" and group is not None:
+                group["GE"] = segment_obj
+            elif segment_name == "IEA" and interchange is not None:
+                interchange["IEA"] = segment_obj
+            elif transaction is not None:
+                transaction[segment_name] = segment_obj
+                if segment_name == "SE":
+                    yield interchange, group, transaction
+                    transaction = None
+            else:
+                if self.diagnostics is not None:
+                    self.report(OUTSIDE_TRANSACTION, segment_name)
+                else:
+                    Debug.log_error("Segment outside of a transaction set: {}".format(segment_name))
+
+        if transaction is not None:
+            yield interchange, group, transaction
+
+    def parse_events(self, data, handler):
+        """ Walks every segment in `data` (a string, text file-like object or
+        memory-mapped file), calling the `EventHandler` methods of `handler`
+        instead of building a result. Returns `handler`. """
+        cursor = self.open_cursor(data)
+        edi_format = self.edi_format
+        while cursor.current is not None:
+            segment = cursor.current
+            segment_name = cursor.name
             if segment == "":
-                edi_segments = edi_segments[1:]
+                if self.stats is not None:
+                    self.stats.record_skipped(len(cursor.segment_delimiter))
+                cursor.advance()
                 continue # Line is blank, skip
-            # Capture current segment name
-            segment_name = segment.split(self.element_delimiter)[0]
-            segment_obj = None
+            if self.edi_format is None:
+                # Route envelope segments and each transaction set to their own formats
+                if segment_name == "ST":
+                    edi_format = self.format_for_transaction(segment)
+                elif segment_name in ENVELOPE_SEGMENTS:
+                    edi_format = get_schema("envelope")
+            seg_format = edi_format.dispatch.get(segment_name) if edi_format is not None else None
+            if seg_format is None:
+                self.unrecognized_segment(segment, segment_name)
+                cursor.advance() # Skipping segment
+            elif seg_format.type == "loop":
+                self.emit_loop(cursor, seg_format, handler)
+            else:
+                self.emit_segments(cursor, seg_format, handler)
+        return handler
+
+    def parse_columns(self, data, path, columns=None):
+        """ Collects every segment at `path` in `data` into typed columns, one
+        per element ID (see `ColumnCollector`), without building the parse result.
+
+        `path` is relative to the parser's format ("L_IT1/IT1"), or starts with
+        the format name ("810/L_IT1/IT1"). Pass the returned collector back in
+        as `columns` to keep adding rows from more messages. """
+        if columns is None:
+            if self.edi_format is not None and not path.startswith(self.edi_format.name + "/"):
+                path = self.edi_format.name + "/" + path
+            try:
+                section = find_section(path)
+            except KeyError:
+                raise ValueError("No segment found at path '{}'".format(path))
+            if section.type != "segment":
+                raise ValueError("Columns can only be collected for a segment, not loop '{}'".format(path))
+            from .columns import ColumnCollector
+            columns = ColumnCollector(section)
+        return self.parse_events(data, columns)
+
+    def emit_segments(self, cursor, segment_format, handler):
+        """ Sends the segment at the cursor (every consecutive one, for a
+        repeating segment) to `handler`, advancing the cursor past them """
+        while cursor.current is not None and cursor.name == segment_format.id:
+            segment = cursor.current
+            view = self.lazy_segment(segment, segment_format)
+            if segment_format.id == "ST":
+                handler.start_transaction(view)
+            handler.segment(view)
+            if segment_format.id == "SE":
+                handler.end_transaction(view)
+            cursor.advance()
+            if segment_format.max_uses == 1:
+                break
+
+    def emit_loop(self, cursor, loop_format, handler):
+        """ Sends every iteration of the loop at the cursor to `handler`, advancing the cursor past it """
+        dispatch = loop_format.dispatch
+        first = loop_format.segments[0]
+        in_iteration = False
+        while cursor.current is not None:
+            seg_format = dispatch.get(cursor.name)
+            if seg_format is None:
+                # Reached the end of valid segments
+                break
+            if in_iteration and seg_format is first:
+                # Beginning a new loop iteration, tie off this one
+                handler.end_loop(loop_format)
+                in_iteration = False
+            if not in_iteration:
+                handler.start_loop(loop_format)
+                in_iteration = True
+            if seg_format.type == "loop":
+                self.emit_loop(cursor, seg_format, handler)
+            else:
+                self.emit_segments(cursor, seg_format, handler)
+        if in_iteration:
+            handler.end_loop(loop_format)
+
+    def format_for_transaction(self, segment):
+        """ Returns the compiled format named by the ST01 element of a raw ST segment """
+        fields = segment.split(self.cursor.element_delimiter)
+        ts_id = fields[1] if len(fields) > 1 else ""
+        if ts_id not in supported_formats:
+            if self.diagnostics is not None:
+                self.report(UNSUPPORTED_TRANSACTION, "ST", detail=ts_id)
+            else:
+                Debug.log_error("Unsupported transaction set type: {}".format(ts_id))
+            return None
+        return get_schema(ts_id)
+
+    def _new_envelope(self, envelope, children_key, parent_list):
+        """ Creates an envelope dict, registering it with its parent when the hierarchy is being collected """
+        if parent_list is not None:
+            envelope[children_key] = []
+            parent_list.append(envelope)
+        return envelope
+
+    def iter_sections(self, cursor):
+        """ Parses top-level sections from the cursor, yielding `(segment_name, segment_obj)` pairs """
+        self.cursor = cursor
+        edi_format = self.edi_format
+        acknowledgments = self.acknowledgments
+        if acknowledgments is not None:
+            from .acknowledgments import ACKNOWLEDGED_SEGMENTS
+        # IDs of the top-level sections found since the ST, while acknowledgments are tracked
+        found = None
+        while cursor.current is not None:
+            segment = cursor.current
+            segment_name = cursor.name
+            if segment == "":
+                if self.stats is not None:
+                    self.stats.record_skipped(len(cursor.segment_delimiter))
+                if self.acknowledgments is not None:
+                    self.acknowledgments.blank_segment()
+                cursor.advance()
+                continue # Line is blank, skip
+            if acknowledgments is not None and segment_name in ACKNOWLEDGED_SEGMENTS:
+                if segment_name == "SE" and found is not None and edi_format is not None:
+                    self.missing_sections(found, edi_format.mandatory)
+                acknowledgments.envelope_segment(segment_name, segment.split(cursor.element_delimiter), cursor.position)
+                found = set() if segment_name == "ST" else None
+            if self.edi_format is None:
+                # Route envelope segments and each transaction set to their own formats
+                if segment_name == "ST":
+                    edi_format = self.format_for_transaction(segment)
+                elif segment_name in ENVELOPE_SEGMENTS:
+                    edi_format = get_schema("envelope")
+                if self.selection is not None and edi_format is not None:
+                    self.select_format(edi_format)
             # Find corresponding segment/loop format
-            for seg_format in self.edi_format:
-                # Check if segment is just a segment, a repeating segment, or part of a loop
-                if seg_format["id"] == segment_name and seg_format["max_uses"] == 1:
-                    # Found a segment
-                    segment_obj = self.parse_segment(segment, seg_format)
-                    edi_segments = edi_segments[1:]
-                    break
-                elif seg_format["id"] == segment_name and seg_format["max_uses"] > 1:
-                    # Found a repeating segment
-                    segment_obj, edi_segments = self.parse_repeating_segment(edi_segments, seg_format)
-                    break
-                elif seg_format["id"] == "L_" + segment_name:
-                    # Found a loop
-                    segment_name = seg_format["id"]
-                    segment_obj, edi_segments = self.parse_loop(edi_segments, seg_format)
-                    break
-                
-            if segment_obj is None:
-                Debug.log_error("Unrecognized segment: {}".format(segment))
-                edi_segments = edi_segments[1:] # Skipping segment
+            seg_format = edi_format.dispatch.get(segment_name) if edi_format is not None else None
+            if seg_format is None:
+                self.unrecognized_segment(segment, segment_name)
+                cursor.advance() # Skipping segment
                 continue
                 # raise ValueError
+            if found is not None:
+                found.add(seg_format.id)
 
-            found_segments.append(segment_name)
-            to_return[segment_name] = segment_obj
+            # Check if segment is just a segment, a repeating segment, or part of a loop
+            if seg_format.path in self.skipped:
+                # Left out of this parse
+                self.skip_section(cursor, seg_format)
+                continue
+            elif seg_format.type == "loop":
+                # Found a loop
+                segment_name = seg_format.id
+                segment_obj = self.parse_loop(cursor, seg_format)
+            elif seg_format.max_uses > 1:
+                # Found a repeating segment
+                segment_obj = self.parse_repeating_segment(cursor, seg_format)
+            else:
+                # Found a segment
+                segment_obj = self.build_segment(segment, seg_format)
+                cursor.advance()
 
+            yield segment_name, segment_obj
+            # Another parse may have run while this generator was suspended
+            self.cursor = cursor
 
-        return found_segments, to_return
+    def skip_section(self, cursor, section):
+        """ Advances the cursor past a section left out of the parse, reading only segment IDs """
+        if section.type == "loop":
+            dispatch = section.dispatch
+            while cursor.current is not None:
+                seg_format = dispatch.get(cursor.name)
+                if seg_format is None:
+                    break
+                self.skip_section(cursor, seg_format)
+        else:
+            cursor.advance()
+            if section.max_uses > 1:
+                while cursor.current is not None and cursor.name == section.id:
+                    cursor.advance()
+
+    def split_segments(self, data):
+        """ Breaks `data` up into its raw segments """
+        return data.split(self.segment_delimiter)
+
+    def read_segments(self, fileobj, chunk_size=65536):
+        """ Returns an iterator over the raw segments of `fileobj`, reading it in chunks.
+
+        The start of the file is read right away so the delimiters can be
+        taken from its ISA header. """
+        header = ""
+        while len(header) < 256:
+            chunk = fileobj.read(chunk_size)
+            if not chunk:
+                break
+            header += chunk
+        self.set_delimiters(header)
+        return self._read_chunks(fileobj, chunk_size, header)
 
-    def parse_segment(self, segment, segment_format):
-        """ Parse a segment into a dict according to field IDs """
-        fields = segment.split(self.element_delimiter)
-        if fields[0] != segment_format["id"]:
-            raise TypeError("Segment type {} does not match provided segment format {}".format(fields[0], segment_format["id"]))
-        elif len(fields)-1 > len(segment_format["elements"]):
-            Debug.explain(segment_format)
-            raise TypeError("Segment has more elements than segment definition")
+    def map_segments(self, mapped, encoding):
+        """ Yields each raw segment of a memory-mapped file, decoding one segment at a time """
+        delimiter = self.segment_delimiter.encode(encoding)
+        step = len(delimiter)
+        find = mapped.find
+        position = 0
+        while True:
+            end = find(delimiter, position)
+            if end < 0:
+                yield mapped[position:].decode(encoding)
+                return
+            yield mapped[position:end].decode(encoding)
+            position = end + step
 
-        #segment_name = fields[0]
+    def _read_chunks(self, fileobj, chunk_size, remainder):
+        """ Yields raw segments, carrying any that straddle a chunk boundary over to the next read """
+        segment_delimiter = self.segment_delimiter
+        chunk = ""
+        while True:
+            segments = (remainder + chunk).split(segment_delimiter)
+            remainder = segments.pop()
+            for segment in segments:
+                yield segment
+            chunk = fileobj.read(chunk_size)
+            if not chunk:
+                break
+        yield remainder
+
+    def build_segment(self, segment, segment_format):
+        """ Parses a raw segment into a dict, or wraps it in a lazy view in lazy mode """
+        if self.lazy:
+            return self.lazy_segment(segment, segment_format)
+        fields = segment.split(self.cursor.element_delimiter)
+        if self.acknowledgments is not None:
+            fields = self.check_elements(fields, segment_format)
+        if self.validate and segment_format.syntax_rules:
+            self.validate_segment(fields, segment_format)
+        if self.records:
+            if len(fields)-1 > len(segment_format.elements):
+                self.too_many_elements(segment_format)
+            return self.record_builder.segment(fields, segment_format)
+        return self.parse_segment(fields, segment_format)
+
+    def lazy_segment(self, segment, segment_format):
+        """ Wraps a raw segment in a lazy view, after any checks that cannot wait until it is read """
+        global LazySegment
+        if LazySegment is None:
+            from .lazy import LazySegment
+        cursor = self.cursor
+        delimiter = cursor.element_delimiter
+        if self.acknowledgments is not None:
+            # Every element is checked now, not when (or if) it is read; the
+            # view starts out split and converted
+            fields = self.check_elements(segment.split(delimiter), segment_format)
+            if self.validate and segment_format.syntax_rules:
+                self.validate_segment(fields, segment_format)
+            view = LazySegment(segment, segment_format, delimiter, cursor.position, self.diagnostics)
+            view._fields = fields
+            view._values = self.parse_segment(fields, segment_format)
+            return view
+        if self.diagnostics is not None and segment.count(delimiter) > len(segment_format.elements):
+            # The view would only find this once read, with no collector to report to
+            self.too_many_elements(segment_format)
+        if self.validate and segment_format.syntax_rules:
+            self.validate_segment(segment.split(delimiter), segment_format)
+        return LazySegment(segment, segment_format, delimiter, cursor.position, self.diagnostics)
+
+    def timed_build_segment(self, segment, segment_format):
+        """ build_segment, recording the segment in `stats` """
+        start = perf_counter()
+        segment_obj = type(self).build_segment(self, segment, segment_format)
+        self.stats.record_segment(segment_format, len(segment) + len(self.cursor.segment_delimiter), perf_counter() - start)
+        return segment_obj
+
+    def counted_build_loop(self, loop_dict, loop_format):
+        """ build_loop, recording the loop iteration in `stats` """
+        self.stats.record_loop(loop_format)
+        return type(self).build_loop(self, loop_dict, loop_format)
+
+    def build_loop(self, loop_dict, loop_format):
+        """ Finishes one loop iteration, converting it to a record in records mode """
+        if self.records:
+            return self.record_builder.loop(loop_dict, loop_format)
+        return loop_dict
+
+    def report(self, code, segment_id, path=None, element_id=None, detail=None):
+        """ Records a problem with the segment under the cursor in `diagnostics` """
+        position = self.cursor.position if self.cursor is not None else None
+        self.diagnostics.add(code, position, segment_id, element_id, path, detail)
+
+    def unrecognized_segment(self, segment, segment_name):
+        """ Reports a segment with no definition, before it is skipped """
+        if self.diagnostics is not None:
+            self.report(UNRECOGNIZED_SEGMENT, segment_name)
+        else:
+            Debug.log_error("Unrecognized segment: {}".format(segment))
+        if self.stats is not None:
+            self.stats.record_unrecognized(segment, len(segment) + len(self.cursor.segment_delimiter))
+
+    def too_many_elements(self, segment_format):
+        """ Reports and raises for a segment longer than its definition """
+        if self.diagnostics is not None:
+            self.report(TOO_MANY_ELEMENTS, segment_format.id, segment_format.path)
+        else:
+            Debug.explain(segment_format.definition)
+        raise TypeError("Segment has more elements than segment definition")
+
+    def invalid_element(self, segment_format, element, field, error):
+        """ Reports an element its data type cannot convert. While
+        acknowledgments are tracked its raw text is kept and the parse carries
+        on; otherwise the error is raised. """
+        position = self.cursor.position if self.cursor is not None else None
+        if self.diagnostics is not None:
+            self.report(INVALID_ELEMENT, segment_format.id, segment_format.path, element.id, element.data_type)
+        if self.acknowledgments is not None:
+            return field
+        raise invalid_element(element, field, position) from error
+
+    def check_elements(self, fields, segment_format):
+        """ Reports extra and missing mandatory elements of a split segment for
+        the acknowledgments, returning the fields without any extra ones """
+        elements = segment_format.elements
+        if len(fields)-1 > len(elements):
+            self.report(TOO_MANY_ELEMENTS, segment_format.id, segment_format.path)
+            fields = fields[:len(elements)+1]
+        for position in segment_format.mandatory:
+            if position >= len(fields) or fields[position] == "":
+                self.report(MISSING_ELEMENT, segment_format.id, segment_format.path, elements[position-1].id)
+        return fields
+
+    def missing_sections(self, found, sections):
+        """ Reports the mandatory `sections` whose IDs are not in `found`, at the cursor """
+        for section in sections:
+            if section.id not in found and section.path not in self.skipped:
+                self.report(MISSING_LOOP if section.type == "loop" else MISSING_SEGMENT, section.id, section.path)
+
+    def validate_segment(self, fields, segment_format):
+        """ Checks a split segment against its syntax rules. Violations are
+        recorded in `diagnostics` when there is one, and raised otherwise. """
+        present = presence(fields)
+        if self.diagnostics is None:
+            check_syntax(segment_format, present)
+            return
+        for rule in iter_violations(segment_format.syntax_rules, present):
+            element_id = "{}{:02d}".format(segment_format.id, rule["criteria"][0])
+            self.report(SYNTAX_RULE, segment_format.id, segment_format.path, element_id, rule["rule"])
+
+    def parse_segment(self, fields, segment_format):
+        """ Parse a split segment into a dict according to field IDs """
+        if fields[0] != segment_format.id:
+            raise TypeError("Segment type {} does not match provided segment format {}".format(fields[0], segment_format.id))
+        elif len(fields)-1 > len(segment_format.elements):
+            self.too_many_elements(segment_format)
+
+        # Each element carries its own precompiled converter
         to_return = {}
-        for field, element in zip(fields[1:], segment_format["elements"]): # Skip the segment name field
-            key = element["id"]
-            if element["data_type"] == "DT":
-                if len(field) == 8:
-                    value = datetime.datetime.strptime(field, "%Y%m%d")
-                elif len(field) == 6:
-                    value = datetime.datetime.strptime(field, "%y%m%d")
-                else:
-                    value = field
-            elif element["data_type"] == "TM":
-                if len(field) == 4:
-                    value = datetime.datetime.strptime(field, "%H%M")
-                elif len(field) == 6:
-                    value = datetime.datetime.strptime(field, "%H%M%S")
-            elif element["data_type"] == "N0" and field != "":
-                value = int(field)
-            elif element["data_type"].startswith("N") and field != "":
-                value = float(field) / (10**int(element["data_type"][-1]))
-            elif element["data_type"] == "R" and field != "":
-                value = float(field)
-            else:
-                value = field
-            to_return[key] = value
+        for field, key, parse in zip(fields[1:], segment_format.element_ids, segment_format.element_parsers): # Skip the segment name field
+            try:
+                to_return[key] = parse(field)
+            except ValueError as error:
+                element = segment_format.elements[segment_format.element_index[key]-1]
+                to_return[key] = self.invalid_element(segment_format, element, field, error)
 
         return to_return
 
 
-    def parse_repeating_segment(self, edi_segments, segment_format):
-        """ Parse all instances of this segment, and return any remaining segments with the seg_list """
+    def parse_repeating_segment(self, cursor, segment_format):
+        """ Parse all consecutive instances of this segment, advancing the shared cursor past them """
         seg_list = []
 
-        while len(edi_segments) > 0:
-            segment = edi_segments[0]
-            segment_name = segment.split(self.element_delimiter)[0]
-            if segment_name != segment_format["id"]:
+        while cursor.current is not None:
+            if cursor.name != segment_format.id:
                 break
-            seg_list.append(self.parse_segment(segment, segment_format))
-            edi_segments = edi_segments[1:]
+            seg_list.append(self.build_segment(cursor.current, segment_format))
+            cursor.advance()
+
+        return seg_list
 
-        return seg_list, edi_segments
+    def parse_loop(self, cursor, loop_format):
+        """ Parse all segments that are part of this loop, advancing the shared cursor past them.
 
-    def parse_loop(self, edi_segments, loop_format):
-        """ Parse all segments that are part of this loop, and return any remaining segments with the loop_list """
+        Each segment is looked up in the loop's dispatch table. Its first
+        section starts a new iteration; an ID the loop does not define ends
+        it, handing the segment back to the enclosing context. """
         loop_list = []
         loop_dict = {}
+        dispatch = loop_format.dispatch
+        first = loop_format.segments[0]
+        skipped = self.skipped
+        acknowledgments = self.acknowledgments
 
-        while len(edi_segments) > 0:
-            segment = edi_segments[0]
-            segment_name = segment.split(self.element_delimiter)[0]
-            segment_obj = None
-
-            # Find corresponding segment/loop format
-            for seg_format in loop_format["segments"]:
-                # Check if segment is just a segment, a repeating segment, or part of a loop
-                if seg_format["id"] == segment_name and seg_format["max_uses"] == 1:
-                    # Found a segment
-                    segment_obj = self.parse_segment(segment, seg_format)
-                    edi_segments = edi_segments[1:]
-                elif seg_format["id"] == segment_name and seg_format["max_uses"] > 1:
-                    # Found a repeating segment
-                    segment_obj, edi_segments = self.parse_repeating_segment(edi_segments, seg_format)
-                elif seg_format["id"] == "L_" + segment_name:
-                    # Found a loop
-                    segment_name = seg_format["id"]
-                    segment_obj, edi_segments = self.parse_loop(edi_segments, seg_format)
-            #print(segment_name, segment_obj)
-            if segment_obj is None:
+        while cursor.current is not None:
+            seg_format = dispatch.get(cursor.name)
+            if seg_format is None:
                 # Reached the end of valid segments; return what we have
                 break
-            elif segment_name == loop_format["segments"][0]["id"] and loop_dict != {}: 
+            elif seg_format is first and loop_dict:
                 # Beginning a new loop, tie off this one and start fresh
-                loop_list.append(loop_dict.copy())
+                if acknowledgments is not None:
+                    self.missing_sections(loop_dict, loop_format.mandatory)
+                loop_list.append(self.build_loop(loop_dict, loop_format))
                 loop_dict = {}
-            loop_dict[segment_name] = segment_obj
-        if loop_dict != {}:
-            loop_list.append(loop_dict.copy())
-        return loop_list, edi_segments
+
+            # Check if segment is just a segment, a repeating segment, or part of a loop
+            if skipped and seg_format.path in skipped:
+                # Left out of this parse, but still part of the loop's structure
+                self.skip_section(cursor, seg_format)
+            elif seg_format.type == "loop":
+                # Found a loop
+                loop_dict[seg_format.id] = self.parse_loop(cursor, seg_format)
+            elif seg_format.max_uses > 1:
+                # Found a repeating segment
+                loop_dict[seg_format.id] = self.parse_repeating_segment(cursor, seg_format)
+            else:
+                # Found a segment
+                loop_dict[seg_format.id] = self.build_segment(cursor.current, seg_format)
+                cursor.advance()
+        if loop_dict:
+            if acknowledgments is not None:
+                self.missing_sections(loop_dict, loop_format.mandatory)
+            loop_list.append(self.build_loop(loop_dict, loop_format))
+        return loop_list
@@ -10,6 +10,30 @@ import os
 
 from .EDIGenerator import EDIGenerator, Debug, supported_formats
 from .EDIParser import EDIParser
+from .schema import add_format_path, remove_format_path, set_schema_cache
+
+# Optional features, imported from their modules on first use so that
+# `import pythonedi` only loads what parsing and generating need
+_LAZY_ATTRIBUTES = {
+    "Stats": ".stats",
+    "EventHandler": ".events",
+    "ParseCache": ".cache",
+    "PushParser": ".push",
+    "Diagnostics": ".diagnostics",
+    "Acknowledgments": ".acknowledgments",
+}
+
+def __getattr__(name):
+    module_name = _LAZY_ATTRIBUTES.get(name)
+    if module_name is None:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    import importlib
+    value = getattr(importlib.import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRIBUTES))
 
 def explain(edi_format, section_id=""):
     """ Explains the referenced section of the referenced EDI format.
@@ -0,0 +1,268 @@
+"""
+Functional acknowledgments
+
+Tracks the acceptance of every functional group (GS) and transaction set (ST)
+while they are parsed, so 997 acknowledgments can be written for a whole
+batch straight from that state with `EDIGenerator.build_acknowledgments`.
+"""
+
+from .diagnostics import (Diagnostics, INVALID_ELEMENT, MISSING_ELEMENT, MISSING_LOOP, MISSING_SEGMENT, SYNTAX_RULE,
+                          TOO_MANY_ELEMENTS, UNRECOGNIZED_SEGMENT, UNSUPPORTED_TRANSACTION)
+from .schema import find_section, get_schema
+from .supported_formats import supported_formats
+
+# Envelope segments the parser hands to `Acknowledgments.envelope_segment`
+ACKNOWLEDGED_SEGMENTS = frozenset(("GS", "ST", "SE", "GE"))
+
+# Diagnostic codes mapped to AK304 segment error codes
+SEGMENT_ERRORS = {
+    UNRECOGNIZED_SEGMENT: "2", # Unexpected segment (or "1", unrecognized segment ID, if not in the format at all)
+    MISSING_SEGMENT: "3",
+    MISSING_LOOP: "3", # Noted against the segment that starts the loop
+}
+# Diagnostic codes mapped to AK403 element error codes
+ELEMENT_ERRORS = {
+    MISSING_ELEMENT: "1",
+    SYNTAX_RULE: "2",
+    TOO_MANY_ELEMENTS: "3",
+    INVALID_ELEMENT: "6",
+}
+
+# AK502 transaction set error codes
+TRANSACTION_NOT_SUPPORTED = "1"
+TRAILER_MISSING = "2"
+CONTROL_NUMBER_MISMATCH = "3"
+SEGMENT_COUNT_MISMATCH = "4"
+SEGMENTS_IN_ERROR = "5"
+# AK905 functional group error codes
+GROUP_TRAILER_MISSING = "3"
+GROUP_CONTROL_NUMBER_MISMATCH = "4"
+TRANSACTION_COUNT_MISMATCH = "5"
+
+# Most error codes AK5 and AK9 can carry, and AK4s per AK3
+MAX_ERROR_CODES = 5
+MAX_ELEMENT_NOTES = 99
+
+def _number(field):
+    """ Numeric control numbers and counts as ints, anything else unchanged """
+    return int(field) if field.isdigit() else field
+
+def _field(fields, position):
+    return fields[position] if len(fields) > position else ""
+
+class TransactionAcknowledgment(object):
+    """ Acceptance state of one transaction set """
+    __slots__ = ("ts_id", "control_number", "start", "blanks", "supported", "closed", "errors", "segment_errors")
+
+    def __init__(self, ts_id, control_number, start):
+        self.ts_id = ts_id
+        self.control_number = control_number
+        # Position of the ST segment in the parsed input
+        self.start = start
+        # Blank segments passed since, which do not count as segments of the set
+        self.blanks = 0
+        self.supported = True
+        self.closed = False
+        # AK502 codes, and AK3 notes as (position, segment ID) ->
+        # [segment ID, position in set, loop ID, AK304 code, [(AK401, AK403), ...]]
+        self.errors = []
+        self.segment_errors = {}
+
+    @property
+    def codes(self):
+        """ Every AK502 error code that applies to the transaction set """
+        codes = list(self.errors)
+        if not self.closed:
+            codes.append(TRAILER_MISSING)
+        if self.segment_errors:
+            codes.append(SEGMENTS_IN_ERROR)
+        return codes
+
+    @property
+    def status(self):
+        """ AK501 acknowledgment code: "A"ccepted or "R"ejected """
+        return "R" if self.errors or self.segment_errors or not self.closed else "A"
+
+    def set_position(self, position):
+        """ Count position in the set (ST is 1) of the segment at `position` in the input """
+        return position - self.start + 1 - self.blanks
+
+    def segment_error(self, position, segment_id, code):
+        """ Returns the AK3 note for segment `segment_id` at `position`, adding it if needed.
+        A missing segment is noted at the position of the segment found in its place. """
+        key = (position, segment_id)
+        note = self.segment_errors.get(key)
+        if note is None:
+            # AK303 only names loops bounded by LS/LE segments, which the formats do not use
+            note = [segment_id, self.set_position(position), None, code, []]
+            self.segment_errors[key] = note
+        return note
+
+class GroupAcknowledgment(object):
+    """ Acceptance state of one functional group and its transaction sets """
+    __slots__ = ("functional_id", "control_number", "version", "transactions", "included", "closed", "errors")
+
+    def __init__(self, functional_id, control_number, version):
+        self.functional_id = functional_id
+        self.control_number = control_number
+        self.version = version
+        self.transactions = []
+        # Transaction set count from GE01, once the trailer is reached
+        self.included = None
+        self.closed = False
+        # AK905 codes
+        self.errors = []
+
+    @property
+    def codes(self):
+        """ Every AK905 error code that applies to the group """
+        codes = list(self.errors)
+        if not self.closed:
+            codes.append(GROUP_TRAILER_MISSING)
+        return codes
+
+    @property
+    def accepted(self):
+        """ Number of accepted transaction sets """
+        return sum(1 for transaction in self.transactions if transaction.status != "R")
+
+    @property
+    def status(self):
+        """ AK901 acknowledgment code: "A"ccepted, accepted with "E"rrors,
+        "P"artially accepted or "R"ejected """
+        accepted = self.accepted
+        if accepted == 0:
+            return "R"
+        if accepted < len(self.transactions):
+            return "P"
+        return "E" if self.codes else "A"
+
+    def segments(self):
+        """ Yields `(path, elements)` for each segment of the 997 body
+        acknowledging this group, from AK1 through AK9. Paths are relative
+        to the 997 format, e.g. "L_AK2/AK5". """
+        if self.functional_id is None:
+            raise ValueError("Transaction sets outside a functional group cannot be acknowledged with a 997")
+        yield "AK1", [self.functional_id, _number(self.control_number)]
+        for transaction in self.transactions:
+            yield "L_AK2/AK2", [transaction.ts_id, transaction.control_number]
+            for segment_id, position, loop_id, code, element_errors in transaction.segment_errors.values():
+                yield "L_AK2/L_AK3/AK3", [segment_id, position, loop_id, code]
+                for element_position, element_code in element_errors[:MAX_ELEMENT_NOTES]:
+                    yield "L_AK2/L_AK3/AK4", [element_position, None, element_code]
+            yield "L_AK2/AK5", [transaction.status] + transaction.codes[:MAX_ERROR_CODES]
+        received = len(self.transactions)
+        included = self.included if isinstance(self.included, int) else received
+        yield "AK9", [self.status, included, received, self.accepted] + self.codes[:MAX_ERROR_CODES]
+
+class Acknowledgments(Diagnostics):
+    """ Diagnostics collector that also tracks the acceptance of each
+    functional group and transaction set parsed, in `groups`.
+
+    Hand it to an `EDIParser` as `acknowledgments`. Envelope control numbers
+    and counts are checked as their trailers arrive, and every problem the
+    parser records is noted against the transaction set it was found in,
+    including mandatory segments and elements left out, which the parser
+    only checks while acknowledgments are tracked.
+    `EDIGenerator.build_acknowledgments(isa, gs, acknowledgments.groups)`
+    then writes the 997s. Transaction sets outside any GS are collected into
+    a group with no GS details (`functional_id` None); a 997 has no group to
+    refer them to, so the builder leaves such groups out. """
+
+    def __init__(self):
+        Diagnostics.__init__(self)
+        self.groups = []
+        self.group = None
+        self.transaction = None
+        self._segment_ids = {}
+
+    def clear(self):
+        Diagnostics.clear(self)
+        self.groups = []
+        self.group = None
+        self.transaction = None
+
+    def envelope_segment(self, segment_name, fields, position):
+        """ Updates the state for a GS, ST, SE or GE segment (split into
+        `fields`) found at `position` in the input """
+        if segment_name == "ST":
+            if self.group is None:
+                self.start_group(GroupAcknowledgment(None, None, None))
+            self.transaction = TransactionAcknowledgment(_field(fields, 1), _field(fields, 2), position)
+            self.group.transactions.append(self.transaction)
+        elif segment_name == "SE":
+            transaction = self.transaction
+            if transaction is None:
+                return
+            if _number(_field(fields, 1)) != transaction.set_position(position):
+                transaction.errors.append(SEGMENT_COUNT_MISMATCH)
+            if _field(fields, 2) != transaction.control_number:
+                transaction.errors.append(CONTROL_NUMBER_MISMATCH)
+            transaction.closed = True
+            self.transaction = None
+        elif segment_name == "GS":
+            self.start_group(GroupAcknowledgment(_field(fields, 1), _field(fields, 6), _field(fields, 8)))
+        elif segment_name == "GE":
+            group = self.group
+            if group is None:
+                return
+            self.transaction = None
+            group.included = _number(_field(fields, 1))
+            if group.included != len(group.transactions):
+                group.errors.append(TRANSACTION_COUNT_MISMATCH)
+            if _field(fields, 2) != group.control_number:
+                group.errors.append(GROUP_CONTROL_NUMBER_MISMATCH)
+            group.closed = True
+            self.group = None
+
+    def blank_segment(self):
+        """ Notes a blank segment, skipped by the parser, at the current position """
+        if self.transaction is not None:
+            self.transaction.blanks += 1
+
+    def start_group(self, group):
+        self.transaction = None
+        self.group = group
+        self.groups.append(group)
+
+    def add(self, code, position=None, segment_id=None, element_id=None, path=None, detail=None):
+        """ Records one problem, noting it against the open transaction set """
+        Diagnostics.add(self, code, position, segment_id, element_id, path, detail)
+        transaction = self.transaction
+        if transaction is None or position is None:
+            return
+        if code == UNSUPPORTED_TRANSACTION:
+            transaction.supported = False
+            transaction.errors.append(TRANSACTION_NOT_SUPPORTED)
+        elif not transaction.supported:
+            # Every segment of an unsupported set is unrecognized; AK502 already says so
+            return
+        elif code in SEGMENT_ERRORS:
+            segment_code = SEGMENT_ERRORS[code]
+            if code == UNRECOGNIZED_SEGMENT and segment_id not in self.segment_ids(transaction.ts_id):
+                segment_code = "1"
+            elif code == MISSING_LOOP:
+                section = find_section(path)
+                while section.type == "loop":
+                    section = section.segments[0]
+                segment_id = section.id
+            transaction.segment_error(position, segment_id, segment_code)
+        elif code in ELEMENT_ERRORS:
+            if element_id is not None:
+                element_position = int(element_id[len(segment_id):])
+            else:
+                # Too many elements: the first one past the definition
+                element_position = len(find_section(path).elements) + 1
+            note = transaction.segment_error(position, segment_id, "8")
+            note[4].append((element_position, ELEMENT_ERRORS[code]))
+
+    def segment_ids(self, ts_id):
+        """ IDs of every segment defined by a transaction set format """
+        segment_ids = self._segment_ids.get(ts_id)
+        if segment_ids is None:
+            if ts_id not in supported_formats:
+                # Only reached with a fixed parser format; nothing is defined for this set
+                return frozenset()
+            segment_ids = frozenset(section.id for section in get_schema(ts_id).paths.values() if section.type == "segment")
+            self._segment_ids[ts_id] = segment_ids
+        return segment_ids
@@ -0,0 +1,235 @@
+"""
+Parse result and compiled schema caches
+
+Keeps the results of `EDIParser.parse` keyed by a hash of the message text
+and the parser settings, so a retransmitted interchange is returned from the
+cache instead of being parsed again. Results are held in an in-memory LRU
+and, optionally, pickled into a directory capped at a total size.
+
+Compiled format schemas can likewise be pickled into a directory, so a new
+process loads them instead of decoding and compiling the JSON definitions.
+"""
+
+import os
+from collections import OrderedDict
+
+from .debug import Debug
+
+# Bump when the layout of the compiled schema objects changes
+SCHEMA_CACHE_VERSION = 4
+
+def _remove(path):
+    """ Removes a cache file, unless another process already has """
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+class ParseCache(object):
+    """ Two-tier cache of parse results.
+
+    `max_entries` results are kept in memory, least recently used first out.
+    With a `directory`, results are also written there as pickles, and the
+    least recently used files are removed once the directory holds more than
+    `max_disk_bytes`.
+
+    Cached results are shared between every parse that hits them, so treat
+    them as read-only. """
+
+    def __init__(self, max_entries=128, directory=None, max_disk_bytes=64*1024*1024):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def empty_copy(self):
+        """ Returns a new cache with the same limits, sharing only the directory tier """
+        return type(self)(self.max_entries, self.directory, self.max_disk_bytes)
+
+    def key(self, data, settings):
+        """ Returns the cache key for `data` (a string or buffer) parsed with `settings` """
+        import hashlib
+        digest = hashlib.sha256(repr(settings).encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(data.encode("utf-8") if isinstance(data, str) else data)
+        return digest.hexdigest()
+
+    def get(self, key):
+        """ Returns the cached value for `key`, or None """
+        value = self._memory.get(key)
+        if value is not None:
+            self._memory.move_to_end(key)
+        elif self.directory is not None:
+            value = self._read(key)
+            if value is not None:
+                self._remember(key, value)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """ Stores `value` under `key` in every tier """
+        self._remember(key, value)
+        if self.directory is not None:
+            self._write(key, value)
+
+    def clear(self):
+        """ Empties both tiers """
+        self._memory.clear()
+        if self.directory is not None:
+            for path, size, mtime in self._disk_entries():
+                _remove(path)
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".pickle")
+
+    def _read(self, key):
+        import pickle
+        path = self._path(key)
+        try:
+            with open(path, "rb") as cache_file:
+                value = pickle.load(cache_file)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            # Unreadable entries are dropped and parsed again
+            Debug.log_warning("Discarding unreadable parse cache entry {}: {}".format(path, e))
+            _remove(path)
+            return None
+        # Mark as recently used for eviction (unless another process just evicted it)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return value
+
+    def _write(self, key, value):
+        import pickle
+        path = self._path(key)
+        # Other processes may be writing the same key
+        temporary_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(temporary_path, "wb") as cache_file:
+            pickle.dump(value, cache_file, pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, path)
+        self._evict()
+
+    def _disk_entries(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".pickle"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue # Removed by another process
+                entries.append((entry.path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _evict(self):
+        """ Removes the least recently used files until the directory fits in `max_disk_bytes` """
+        entries = self._disk_entries()
+        total = sum(size for path, size, mtime in entries)
+        for path, size, mtime in sorted(entries, key=lambda entry: entry[2]):
+            if total <= self.max_disk_bytes:
+                break
+            _remove(path)
+            total -= size
+
+class SchemaCache(object):
+    """ Directory of pickled compiled schemas, one file per definition file.
+
+    Each entry records the modification time, size and SHA-256 of the JSON it
+    was compiled from. An entry is used as is while the time and size match;
+    otherwise the JSON is hashed, and only compiled again if it changed. """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def load(self, format_name, source_path, compile_schema):
+        """ Returns the compiled schema for the definition file at
+        `source_path`, calling `compile_schema(format_name, definition)` (and
+        storing the result) when there is no valid entry """
+        stat = os.stat(source_path)
+        import hashlib
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        path = self._path(format_name, source_path)
+        header = self._read_header(path, source_path)
+        if header is not None and header[2] == stamp:
+            schema = self._read_schema(path)
+            if schema is not None:
+                self.hits += 1
+                return schema
+        with open(source_path, "rb") as source_file:
+            source = source_file.read()
+        digest = hashlib.sha256(source).hexdigest()
+        if header is not None and header[3] == digest:
+            # Touched or copied, but unchanged
+            schema = self._read_schema(path)
+            if schema is not None:
+                self.hits += 1
+                self._write(path, source_path, stamp, digest, schema)
+                return schema
+        from .supported_formats import parse_format
+        self.misses += 1
+        schema = compile_schema(format_name, parse_format(format_name, source))
+        self._write(path, source_path, stamp, digest, schema)
+        return schema
+
+    def clear(self):
+        """ Removes every entry """
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".schema"):
+                _remove(entry.path)
+
+    def _path(self, format_name, source_path):
+        import hashlib
+        # Same-named formats from different directories get separate entries
+        source_key = hashlib.sha1(source_path.encode("utf-8")).hexdigest()[:12]
+        return os.path.join(self.directory, "{}-{}.schema".format(format_name, source_key))
+
+    def _read_header(self, path, source_path):
+        import pickle
+        try:
+            with open(path, "rb") as cache_file:
+                header = pickle.load(cache_file)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            Debug.log_warning("Discarding unreadable schema cache entry {}: {}".format(path, e))
+            return None
+        if header[0] != SCHEMA_CACHE_VERSION or header[1] != source_path:
+            return None
+        return header
+
+    def _read_schema(self, path):
+        import pickle
+        try:
+            with open(path, "rb") as cache_file:
+                # The header comes first, the schema second
+                pickle.load(cache_file)
+                return pickle.load(cache_file)
+        except Exception as e:
+            Debug.log_warning("Discarding unreadable schema cache entry {}: {}".format(path, e))
+            return None
+
+    def _write(self, path, source_path, stamp, digest, schema):
+        import pickle
+        temporary_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(temporary_path, "wb") as cache_file:
+            pickle.dump((SCHEMA_CACHE_VERSION, source_path, stamp, digest), cache_file, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(schema, cache_file, pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, path)
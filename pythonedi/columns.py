@@ -0,0 +1,81 @@
+"""
+Columnar extraction
+
+Collects every occurrence of one segment (e.g. the IT1 line items of many
+810s) into one column per element, filled straight from the raw segments by
+`EDIParser.parse_columns`, without building per-row dicts. Numeric elements
+go into typed `array.array` columns that NumPy can wrap without copying.
+"""
+
+from array import array
+from functools import partial
+from itertools import zip_longest
+
+from .events import EventHandler
+
+MISSING_NUMBER = float("nan")
+
+def _scaled(divisor, field):
+    return float(field) / divisor
+
+def column_for(element):
+    """ Returns `(column, convert, missing)` for a compiled element: an empty
+    column, the converter for its non-empty fields, and the value stored
+    when the element is empty or left off """
+    data_type = element.data_type
+    if data_type == "N0" or data_type == "R":
+        return array("d"), float, MISSING_NUMBER
+    elif data_type.startswith("N"):
+        return array("d"), partial(_scaled, 10**element.implied_decimals), MISSING_NUMBER
+    return [], element.parse, None
+
+class ColumnCollector(EventHandler):
+    """ Event handler filling one column per element of a compiled segment.
+
+    `columns` maps element IDs to columns, in definition order:
+    * numeric elements (N0, N1-N9, R): `array("d")`, NaN when missing, so
+      a mandatory element left empty shows up rather than reading as 0
+    * everything else: lists of parsed values, None when missing
+
+    `transactions` holds, for each row, the number of the transaction set it
+    came from (counting from 0 across everything collected). """
+
+    def __init__(self, segment_format):
+        self.schema = segment_format
+        self.columns = {}
+        self._appenders = []
+        for element in segment_format.elements:
+            column, convert, missing = column_for(element)
+            self.columns[element.id] = column
+            self._appenders.append((column.append, convert, missing))
+        self.transactions = array("q")
+        self._transaction = -1
+
+    def __len__(self):
+        return len(self.transactions)
+
+    def start_transaction(self, segment):
+        self._transaction += 1
+
+    def segment(self, segment):
+        if segment.schema is not self.schema:
+            return
+        # Elements left off the end of the segment count as missing
+        for (append, convert, missing), field in zip_longest(self._appenders, segment.fields[1:], fillvalue=""):
+            append(missing if field == "" else convert(field))
+        self.transactions.append(self._transaction)
+
+    def to_numpy(self):
+        """ Returns the columns as NumPy arrays. Numeric columns share memory
+        with the arrays they wrap, so collect everything before converting. """
+        import numpy
+        converted = {}
+        for element_id, column in self.columns.items():
+            if isinstance(column, array):
+                if len(column):
+                    converted[element_id] = numpy.frombuffer(column, dtype=column.typecode)
+                else:
+                    converted[element_id] = numpy.empty(0, dtype=column.typecode)
+            else:
+                converted[element_id] = numpy.array(column, dtype=object)
+        return converted
@@ -4,8 +4,17 @@ Debug printer
 Handles logging at different debug levels
 """
 
-from colorama import Fore, Style, init
-init()
+# colorama is only imported (and stdout only wrapped) once output is needed
+Fore = None
+Style = None
+
+def init_terminal():
+    """ Sets up colored terminal output on first use """
+    global Fore, Style
+    if Fore is None:
+        import colorama
+        colorama.init()
+        Fore, Style = colorama.Fore, colorama.Style
 
 LOOP_TEMPLATE = """
 {tab_level}{HEADER_COLOR}[{id}] {name}{END_COLOR}
@@ -34,11 +43,18 @@ class DebugMaster(object):
     """ Auto-instantiated as Debug to provide a single point of contact """
     def __init__(self):
         self.level = 3
-        self.tags = {
-            "ERROR":   "{}[ ERROR ]{} ".format(Fore.RED+Style.BRIGHT, Style.RESET_ALL),
-            "WARNING": "{}[WARNING]{} ".format(Fore.YELLOW+Style.BRIGHT, Style.RESET_ALL),
-            "MESSAGE": "{}[MESSAGE]{} ".format(Fore.CYAN+Style.BRIGHT, Style.RESET_ALL)
-        }
+        self._tags = None
+
+    @property
+    def tags(self):
+        if self._tags is None:
+            init_terminal()
+            self._tags = {
+                "ERROR":   "{}[ ERROR ]{} ".format(Fore.RED+Style.BRIGHT, Style.RESET_ALL),
+                "WARNING": "{}[WARNING]{} ".format(Fore.YELLOW+Style.BRIGHT, Style.RESET_ALL),
+                "MESSAGE": "{}[MESSAGE]{} ".format(Fore.CYAN+Style.BRIGHT, Style.RESET_ALL)
+            }
+        return self._tags
 
     def log(self, message, level=1):
         """ Creates a custom message at the specified level """
@@ -47,20 +63,23 @@ class DebugMaster(object):
 
     def log_error(self, message):
         """ Creates an error-level log messsage """
-        self.log(self.tags["ERROR"] + message, 1)
+        if self.level >= 1:
+            self.log(self.tags["ERROR"] + message, 1)
 
     def log_warning(self, message):
         """ Creates a warning-level log messsage """
-        self.log(self.tags["WARNING"] + message, 2)
+        if self.level >= 2:
+            self.log(self.tags["WARNING"] + message, 2)
 
     def log_message(self, message):
         """ Creates a message-level log messsage """
-        self.log(self.tags["MESSAGE"] + message, 3)
+        if self.level >= 3:
+            self.log(self.tags["MESSAGE"] + message, 3)
 
     def explain(self, structure):
-        print(self.level)
         if self.level <= 1:
             return # Only explain if debugging level is 2+
+        init_terminal()
         # Decide which type of structure this is
         if type(structure) is list:
             for segment in structure:
@@ -78,6 +97,7 @@ class DebugMaster(object):
     def explain_segment(self, segment, tab_level = ""):
         if self.level <= 1:
             return # Only explain if debugging level is 2+
+        init_terminal()
         print(Fore.CYAN + "\n" + tab_level + "-- [Segment] --" + Fore.RESET)
         if segment["type"] == "segment":
             # Parse syntax rules into human-readable format
@@ -121,6 +141,7 @@ class DebugMaster(object):
     def explain_element(self, index, element, tab_level = ""):
         if self.level <= 1:
             return # Only explain if debugging level is 2+
+        init_terminal()
         # Print template
         print(ELEMENT_TEMPLATE.format(
             tab_level=tab_level,
@@ -133,6 +154,7 @@ class DebugMaster(object):
     def explain_loop(self, loop, tab_level=""):
         if self.level <= 1:
             return # Only explain if debugging level is 2+
+        init_terminal()
         print(Fore.RED + "-- [Loop] --" + Style.RESET_ALL)
         print(LOOP_TEMPLATE.format(
             tab_level=tab_level,
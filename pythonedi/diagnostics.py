@@ -0,0 +1,94 @@
+"""
+Diagnostics collector
+
+Collects compact records of what went wrong in a parse or build, instead of
+printing each problem as it is found. Nothing is formatted until the
+records are rendered or explained.
+"""
+
+from collections import namedtuple
+
+from .schema import find_section
+from .debug import Debug
+
+# Error codes
+UNRECOGNIZED_SEGMENT = "unrecognized_segment"
+OUTSIDE_TRANSACTION = "outside_transaction"
+UNSUPPORTED_TRANSACTION = "unsupported_transaction"
+TOO_MANY_ELEMENTS = "too_many_elements"
+SYNTAX_RULE = "syntax_rule"
+MISSING_SEGMENT = "missing_segment"
+MISSING_LOOP = "missing_loop"
+MISSING_ELEMENT = "missing_element"
+INVALID_ELEMENT = "invalid_element"
+INVALID_DEFINITION = "invalid_definition"
+
+MESSAGES = {
+    UNRECOGNIZED_SEGMENT: "Unrecognized segment {segment_id}",
+    OUTSIDE_TRANSACTION: "Segment {segment_id} is outside of a transaction set",
+    UNSUPPORTED_TRANSACTION: "Unsupported transaction set type {detail}",
+    TOO_MANY_ELEMENTS: "Segment {segment_id} has more elements than its definition",
+    SYNTAX_RULE: "Segment {segment_id} breaks its {detail} syntax rule on {element_id}",
+    MISSING_SEGMENT: "Mandatory segment {segment_id} is missing",
+    MISSING_LOOP: "Loop {segment_id} with mandatory segments is missing",
+    MISSING_ELEMENT: "Mandatory element {element_id} is missing",
+    INVALID_ELEMENT: "Element {element_id} could not be converted to data type {detail}",
+    INVALID_DEFINITION: "Invalid format definition for {segment_id}",
+}
+
+def invalid_element(element, field, position):
+    """ Returns the ValueError raised for element text its data type cannot convert """
+    return ValueError("Element {} ({}) of the segment at position {}: '{}' is not valid {} data".format(
+        element.id, element.name, position, field, element.data_type))
+
+# `position` is the index of the segment in the parsed input (None for builds);
+# `path` the compiled section path, when the section is known
+Diagnostic = namedtuple("Diagnostic", ("code", "position", "segment_id", "element_id", "path", "detail"))
+
+class Diagnostics(object):
+    """ Error records collected from the EDIParser or EDIGenerator it is handed to.
+
+    While a collector is attached, parsers record problems they can step past
+    (unrecognized segments, unsupported transaction sets, syntax rule
+    violations with `validate=True`) and carry on. Errors that stop a parse or
+    build are recorded before they are raised. Nothing is printed either way. """
+
+    def __init__(self):
+        self.records = []
+
+    def add(self, code, position=None, segment_id=None, element_id=None, path=None, detail=None):
+        """ Records one problem """
+        self.records.append(Diagnostic(code, position, segment_id, element_id, path, detail))
+
+    def clear(self):
+        self.records = []
+
+    def counts(self):
+        """ Returns the number of records per error code """
+        counts = {}
+        for record in self.records:
+            counts[record.code] = counts.get(record.code, 0) + 1
+        return counts
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def describe(self, record):
+        """ Returns a one-line, human-readable description of a record """
+        message = MESSAGES.get(record.code, record.code).format(**record._asdict())
+        if record.position is not None:
+            message = "Segment #{}: {}".format(record.position + 1, message)
+        return message
+
+    def render(self):
+        """ Returns every record as human-readable text, one per line """
+        return "\n".join(self.describe(record) for record in self.records)
+
+    def explain(self, record):
+        """ Prints the description of a record and the definition of the section it concerns """
+        Debug.log_error(self.describe(record))
+        if record.path is not None:
+            Debug.explain(find_section(record.path).definition)
@@ -0,0 +1,31 @@
+"""
+Event-driven parsing
+
+Handlers for `EDIParser.parse_events`, which walks a message with the same
+format definitions as `EDIParser.parse` but calls back for each segment and
+loop instead of building the nested result.
+"""
+
+class EventHandler(object):
+    """ Base class for `EDIParser.parse_events` handlers. Every event does
+    nothing by default; override the ones you need.
+
+    Segments arrive as `LazySegment` views, so elements are only split and
+    converted if the handler reads them; `segment.schema` is the compiled
+    segment definition (with its `id` and `path`, e.g. "810/L_IT1/IT1"). Loop
+    events get the compiled loop definition and fire once per loop iteration. """
+
+    def start_transaction(self, segment):
+        """ Called with the ST segment, before its `segment` event """
+
+    def end_transaction(self, segment):
+        """ Called with the SE segment, after its `segment` event """
+
+    def start_loop(self, loop):
+        """ Called before the first segment of each loop iteration """
+
+    def end_loop(self, loop):
+        """ Called after the last segment of each loop iteration """
+
+    def segment(self, segment):
+        """ Called for every recognized segment, envelope segments included """
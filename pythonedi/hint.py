@@ -3,10 +3,7 @@ Explainer produces a human-readable version of the expectation for the
 formatted data.
 """
 
-from colorama import Fore, Style, init
-
-# Initialize colorama wrapper
-init()
+from . import debug
 
 SEGMENT_TEMPLATE = """
 {HEADER_COLOR}[{id}] {name}{END_COLOR}
@@ -26,6 +23,7 @@ ELEMENT_TEMPLATE = """
 """
 
 def explain(structure):
+    debug.init_terminal()
     # Decide which type of structure this is
     if type(structure) is list:
         for segment in structure:
@@ -42,7 +40,8 @@ def explain(structure):
     
 
 def explain_segment(segment):
-    print(Fore.CYAN + "\n-- [Segment] --" + Fore.RESET)
+    debug.init_terminal()
+    print(debug.Fore.CYAN + "\n-- [Segment] --" + debug.Fore.RESET)
     if segment["type"] == "segment":
         # Parse syntax rules into human-readable format
         syntax_rules_list = []
@@ -68,26 +67,27 @@ def explain_segment(segment):
         # Print template
         print(SEGMENT_TEMPLATE.format(
             syntax_rules="; ".join(syntax_rules_list),
-            HEADER_COLOR=Fore.CYAN+Style.BRIGHT,
-            VALUE_COLOR=Fore.YELLOW+Style.BRIGHT,
-            END_COLOR=Fore.RESET+Style.RESET_ALL,
+            HEADER_COLOR=debug.Fore.CYAN+debug.Style.BRIGHT,
+            VALUE_COLOR=debug.Fore.YELLOW+debug.Style.BRIGHT,
+            END_COLOR=debug.Fore.RESET+debug.Style.RESET_ALL,
             **segment))
 
         # Print elements section
-        print(Fore.CYAN + "    -- [Elements] --" + Fore.RESET)
+        print(debug.Fore.CYAN + "    -- [Elements] --" + debug.Fore.RESET)
         for i, element in enumerate(segment["elements"]):
             explain_element("{}{:02d}: ".format(segment["id"], i+1), element)
     
     # End segment
-    print(Fore.CYAN + "--------------------" + Fore.RESET)
+    print(debug.Fore.CYAN + "--------------------" + debug.Fore.RESET)
 
 def explain_element(index, element):
+    debug.init_terminal()
     # Print template
     print(ELEMENT_TEMPLATE.format(
         index=index,
-        HEADER_COLOR=Fore.GREEN,
-        VALUE_COLOR=Fore.YELLOW+Style.BRIGHT,
-        END_COLOR=Fore.RESET+Style.RESET_ALL,
+        HEADER_COLOR=debug.Fore.GREEN,
+        VALUE_COLOR=debug.Fore.YELLOW+debug.Style.BRIGHT,
+        END_COLOR=debug.Fore.RESET+debug.Style.RESET_ALL,
         **element))
 
 def explain_loop(loop):
@@ -0,0 +1,83 @@
+"""
+Lazy segment views
+
+Wraps the raw text of a parsed segment so elements are only split and
+converted when they are first accessed.
+"""
+
+from collections.abc import Mapping
+
+from .schema import find_section
+from .diagnostics import INVALID_ELEMENT, invalid_element
+from .debug import Debug
+
+def restore_lazy_segment(segment, path, delimiter, position=None):
+    """ Rebuilds a pickled lazy view from its raw text and schema path """
+    return LazySegment(segment, find_section(path), delimiter, position)
+
+class LazySegment(Mapping):
+    """ Read-only dict-like view over the raw text of one segment.
+
+    The segment is split on first access, and each element is converted by
+    its compiled parser the first time it is read, then cached. Keys and
+    values match the dict `EDIParser.parse_segment` would have built.
+
+    `position` is where the segment was found in the parsed input; an
+    element that cannot be converted is reported there to `diagnostics`,
+    if given, before the error is raised. """
+    __slots__ = ("segment", "schema", "delimiter", "position", "diagnostics", "_fields", "_values")
+
+    def __init__(self, segment, schema, delimiter, position=None, diagnostics=None):
+        self.segment = segment
+        self.schema = schema
+        self.delimiter = delimiter
+        self.position = position
+        self.diagnostics = diagnostics
+        self._fields = None
+        self._values = None
+
+    @property
+    def fields(self):
+        """ The split segment, including the segment ID """
+        if self._fields is None:
+            fields = self.segment.split(self.delimiter)
+            if len(fields)-1 > len(self.schema.elements):
+                Debug.explain(self.schema.definition)
+                raise TypeError("Segment has more elements than segment definition")
+            self._fields = fields
+        return self._fields
+
+    def __getitem__(self, key):
+        values = self._values
+        if values is None:
+            values = self._values = {}
+        elif key in values:
+            return values[key]
+        index = self.schema.element_index.get(key)
+        fields = self.fields
+        if index is None or index >= len(fields):
+            raise KeyError(key)
+        try:
+            value = self.schema.element_parsers[index-1](fields[index])
+        except ValueError as error:
+            schema = self.schema
+            element = schema.elements[index-1]
+            if self.diagnostics is not None:
+                self.diagnostics.add(INVALID_ELEMENT, self.position, schema.id, element.id, schema.path, element.data_type)
+            raise invalid_element(element, fields[index], self.position) from error
+        values[key] = value
+        return value
+
+    def __iter__(self):
+        return iter(self.schema.element_ids[:len(self.fields)-1])
+
+    def __len__(self):
+        return len(self.fields)-1
+
+    def __reduce__(self):
+        # Only the raw text travels; the schema is looked up again on arrival,
+        # and any diagnostics collector stays behind
+        return restore_lazy_segment, (self.segment, self.schema.path, self.delimiter, self.position)
+
+    def __repr__(self):
+        return "LazySegment({!r})".format(self.segment)
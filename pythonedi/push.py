@@ -0,0 +1,142 @@
+"""
+Push parsing
+
+Parses an EDI stream handed over in arbitrary chunks (network buffers,
+message queue payloads, ...) instead of read from a complete string or file.
+"""
+
+import codecs
+
+from .EDIParser import EDIParser, SegmentCursor
+from .records import RecordBuilder
+from .diagnostics import OUTSIDE_TRANSACTION
+from .debug import Debug
+
+# Characters needed before the delimiters are read from the ISA header
+HEADER_LENGTH = 256
+
+class PushParser(object):
+    """ Incremental parser for one EDI stream, fed with `feed(chunk)` and
+    finished with `close()`.
+
+    Chunks may be text or bytes (decoded as `encoding`, including characters
+    split between chunks) and may end anywhere, even mid-segment. Both calls
+    return the `(interchange, group, transaction)` tuples, as yielded by
+    `EDIParser.iter_transactions`, of the transaction sets completed so far.
+    A transaction set is parsed as soon as its SE arrives; until then only
+    its raw segments are held. """
+
+    def __init__(self, parser=None, encoding="utf-8"):
+        self.parser = parser or EDIParser()
+        self.decoder = codecs.getincrementaldecoder(encoding)()
+        self.buffer = ""
+        self.started = False
+        self.closed = False
+        self.interchange = None
+        self.group = None
+        # Raw segments of the open transaction set, and the stream position
+        # of its ST (positions in diagnostics count from the start of the stream)
+        self.transaction = None
+        self.transaction_start = 0
+        self.position = 0
+        # Read from the ISA header once the stream starts
+        self.delimiters = None
+
+    def feed(self, chunk):
+        """ Adds the next chunk of the stream, returning the transaction sets it completed """
+        if self.closed:
+            raise ValueError("Cannot feed a closed PushParser")
+        if not isinstance(chunk, str):
+            chunk = self.decoder.decode(chunk)
+        self.buffer += chunk
+        if not self.started:
+            if len(self.buffer) < HEADER_LENGTH:
+                return []
+            self.start()
+        return self.consume(final=False)
+
+    def close(self):
+        """ Ends the stream, returning the transaction sets still to be completed """
+        if self.closed:
+            return []
+        self.buffer += self.decoder.decode(b"", final=True)
+        self.closed = True
+        if not self.started:
+            self.start()
+        finished = self.consume(final=True)
+        if self.transaction is not None:
+            # Last transaction set was never closed with an SE
+            finished.append(self.finish_transaction())
+        return finished
+
+    def start(self):
+        """ Reads the delimiters from the start of the stream """
+        self.delimiters = self.parser.set_delimiters(self.buffer)
+        if self.parser.records:
+            self.parser.record_builder = RecordBuilder(self.parser.invalid_element)
+        self.started = True
+
+    def consume(self, final):
+        """ Handles every complete segment in the buffer, keeping any partial one for the next chunk """
+        segments = self.buffer.split(self.delimiters[1])
+        self.buffer = "" if final else segments.pop()
+        finished = []
+        for segment in segments:
+            self.push_segment(segment, finished)
+            self.position += 1
+        return finished
+
+    def push_segment(self, segment, finished):
+        """ Routes one raw segment, appending any transaction set it completes to `finished` """
+        if segment == "":
+            return # Line is blank, skip
+        end = segment.find(self.delimiters[0])
+        segment_name = segment if end < 0 else segment[:end]
+        if segment_name == "ISA":
+            if self.transaction is not None:
+                finished.append(self.finish_transaction())
+            self.interchange = {"ISA": self.parse_envelope(segment, segment_name)}
+            self.group = None
+        elif segment_name == "GS":
+            if self.transaction is not None:
+                finished.append(self.finish_transaction())
+            self.group = {"GS": self.parse_envelope(segment, segment_name)}
+        elif segment_name == "ST":
+            if self.transaction is not None:
+                # Previous transaction set was never closed with an SE
+                finished.append(self.finish_transaction())
+            self.transaction = [segment]
+            self.transaction_start = self.position
+        elif segment_name == "GE" and self.group is not None:
+            self.group["GE"] = self.parse_envelope(segment, segment_name)
+        elif segment_name == "IEA" and self.interchange is not None:
+            self.interchange["IEA"] = self.parse_envelope(segment, segment_name)
+        elif self.transaction is not None:
+            self.transaction.append(segment)
+            if segment_name == "SE":
+                finished.append(self.finish_transaction())
+        elif self.parser.diagnostics is not None:
+            self.parser.diagnostics.add(OUTSIDE_TRANSACTION, self.position, segment_name)
+        else:
+            Debug.log_error("Segment outside of a transaction set: {}".format(segment_name))
+
+    def parse_envelope(self, segment, segment_name):
+        """ Parses a single envelope segment """
+        found_segments, parsed = self.parser.collect_sections(self.cursor([segment], self.position))
+        return parsed.get(segment_name)
+
+    def cursor(self, segments, position):
+        """ Returns a cursor over buffered segments, the first of which is at `position` in the stream """
+        cursor = SegmentCursor(segments, *self.delimiters)
+        cursor.position += position
+        return cursor
+
+    def finish_transaction(self):
+        """ Parses the buffered segments of the open transaction set """
+        segments, self.transaction = self.transaction, None
+        found_segments, transaction = self.parser.collect_sections(self.cursor(segments, self.transaction_start))
+        if self.interchange is None:
+            self.interchange = {}
+        if self.group is None:
+            self.group = {}
+        return self.interchange, self.group, transaction
@@ -0,0 +1,122 @@
+"""
+Compact record classes
+
+Generates a __slots__ class for each segment and loop definition, so large
+parse results hold one small object per segment or loop iteration instead of
+a dict keyed by element IDs.
+"""
+
+from collections.abc import Mapping
+
+from .schema import find_section
+
+def restore_record(path, values):
+    """ Rebuilds a pickled record from its schema path and values """
+    cls = record_class(find_section(path))
+    record = cls.__new__(cls)
+    for key, value in values.items():
+        setattr(record, key, value)
+    return record
+
+class Record(Mapping):
+    """ Base for the generated record classes.
+
+    Fields are attributes (`record.IT101`), and records also read like the
+    dicts they replace (`record["IT101"]`), including comparing equal to them.
+    Fields that were not present in the input are simply unset. """
+    __slots__ = ()
+    schema = None
+    _fields = ()
+    _field_set = frozenset()
+
+    def __getitem__(self, key):
+        if key not in self._field_set:
+            raise KeyError(key)
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __iter__(self):
+        for key in self._fields:
+            if hasattr(self, key):
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __reduce__(self):
+        return restore_record, (self.schema.path, dict(self))
+
+    def __repr__(self):
+        return "{}({})".format(type(self).__name__, ", ".join("{}={!r}".format(key, value) for key, value in self.items()))
+
+class SegmentRecord(Record):
+    """ Base for generated segment records; one slot per element ID """
+    __slots__ = ()
+
+class LoopRecord(Record):
+    """ Base for generated loop iteration records; one slot per segment/loop ID """
+    __slots__ = ()
+
+def record_class(section):
+    """ Returns the record class for a compiled segment or loop, generating it on first use """
+    cls = section.record_class
+    if cls is None:
+        if section.type == "loop":
+            base = LoopRecord
+            fields = tuple(child.id for child in section.segments)
+        else:
+            base = SegmentRecord
+            fields = section.element_ids
+        cls = type(str(section.id), (base,), {
+            "__slots__": fields,
+            "__module__": __name__,
+            "schema": section,
+            "_fields": fields,
+            "_field_set": frozenset(fields),
+        })
+        # Slot descriptors, so records can be filled without attribute name lookups
+        cls._setters = tuple(getattr(cls, field).__set__ for field in fields)
+        if section.type == "segment":
+            cls._interned = tuple(element.data_type == "ID" for element in section.elements)
+        section.record_class = cls
+    return cls
+
+class RecordBuilder(object):
+    """ Builds records for one parse call.
+
+    ID-code values (qualifiers, units of measure, ...) are interned across
+    everything the builder produces, so repeated codes share one string. """
+
+    def __init__(self, invalid_element=None):
+        self.interned = {}
+        # Called as invalid_element(segment_format, element, field, error)
+        # for an element its data type cannot convert
+        self.invalid_element = invalid_element
+
+    def segment(self, fields, segment_format):
+        """ Builds a segment record from a split segment, already checked
+        against the length of its definition by the parser """
+        cls = segment_format.record_class or record_class(segment_format)
+        record = cls.__new__(cls)
+        interned = self.interned
+        for setter, element, parse, intern, field in zip(cls._setters, segment_format.elements, segment_format.element_parsers, cls._interned, fields[1:]):
+            try:
+                value = parse(field)
+            except ValueError as error:
+                if self.invalid_element is None:
+                    raise
+                value = self.invalid_element(segment_format, element, field, error)
+            if intern:
+                value = interned.setdefault(value, value)
+            setter(record, value)
+        return record
+
+    def loop(self, loop_dict, loop_format):
+        """ Builds a loop iteration record from a dict of its sections """
+        cls = loop_format.record_class or record_class(loop_format)
+        record = cls.__new__(cls)
+        for key, value in loop_dict.items():
+            setattr(record, key, value)
+        return record
@@ -0,0 +1,368 @@
+"""
+Compiled format definitions
+
+Turns the JSON format definitions into schema objects once, so the parser and
+generator can convert each element with a ready-made function instead of
+re-interpreting its data type every time.
+"""
+
+import datetime
+import os
+from functools import partial
+
+from .supported_formats import supported_formats
+from .syntax import compile_rules
+
+# Segments that wrap transaction sets rather than belonging to one
+ENVELOPE_SEGMENTS = ("ISA", "GS", "GE", "IEA")
+
+# Parsed dates/times are immutable, so identical fields can share one object
+DATE_CACHE_SIZE = 4096
+_date_cache = {}
+_time_cache = {}
+
+def _parse_date(field):
+    """ Parses a CCYYMMDD or YYMMDD date, returning anything else unchanged """
+    value = _date_cache.get(field)
+    if value is not None:
+        return value
+    length = len(field)
+    if length == 8:
+        if field.isdigit() and field.isascii():
+            value = datetime.datetime(int(field[:4]), int(field[4:6]), int(field[6:]))
+        else:
+            value = datetime.datetime.strptime(field, "%Y%m%d")
+    elif length == 6:
+        if field.isdigit() and field.isascii():
+            # Same century pivot as strptime's %y
+            year = int(field[:2])
+            year += 2000 if year < 69 else 1900
+            value = datetime.datetime(year, int(field[2:4]), int(field[4:]))
+        else:
+            value = datetime.datetime.strptime(field, "%y%m%d")
+    else:
+        return field
+    if len(_date_cache) >= DATE_CACHE_SIZE:
+        _date_cache.clear()
+    _date_cache[field] = value
+    return value
+
+def _parse_time(field):
+    """ Parses an HHMM or HHMMSS time, returning anything else unchanged """
+    value = _time_cache.get(field)
+    if value is not None:
+        return value
+    length = len(field)
+    if length == 4:
+        if field.isdigit() and field.isascii():
+            value = datetime.datetime(1900, 1, 1, int(field[:2]), int(field[2:]))
+        else:
+            value = datetime.datetime.strptime(field, "%H%M")
+    elif length == 6:
+        if field.isdigit() and field.isascii():
+            value = datetime.datetime(1900, 1, 1, int(field[:2]), int(field[2:4]), int(field[4:]))
+        else:
+            value = datetime.datetime.strptime(field, "%H%M%S")
+    else:
+        return field
+    if len(_time_cache) >= DATE_CACHE_SIZE:
+        _time_cache.clear()
+    _time_cache[field] = value
+    return value
+
+def _parse_integer(field):
+    return int(field) if field != "" else field
+
+def _parse_decimal(divisor, field):
+    return float(field) / divisor if field != "" else field
+
+def _parse_real(field):
+    return float(field) if field != "" else field
+
+def _format_strftime(pattern, value):
+    return value.strftime(pattern)
+
+def _format_real(value):
+    return str(float(value))
+
+def _format_number(template, value):
+    return template.format(float(value))
+
+def _format_empty(value):
+    return ""
+
+def _format_invalid(message, value):
+    raise ValueError(message)
+
+class CompiledSchema(object):
+    """ Base for compiled schema objects.
+
+    Compiled schemas pickle without their generated record classes, so they
+    can be handed to worker processes or cached on disk. """
+    __slots__ = ()
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__ if name != "record_class"}
+
+    def __setstate__(self, state):
+        if "record_class" in self.__slots__:
+            self.record_class = None
+        for name, value in state.items():
+            setattr(self, name, value)
+
+class ElementSchema(CompiledSchema):
+    """ A compiled element definition with its converters worked out in advance """
+    __slots__ = ("id", "name", "req", "data_type", "data_type_ids", "min_length", "max_length",
+                 "implied_decimals", "parse", "format", "definition")
+
+    def __init__(self, definition):
+        self.definition = definition
+        self.id = definition["id"]
+        self.name = definition["name"]
+        self.req = definition["req"]
+        self.data_type = definition["data_type"]
+        self.data_type_ids = definition["data_type_ids"]
+        self.min_length = definition["length"]["min"]
+        self.max_length = definition["length"]["max"]
+        self.implied_decimals = None
+
+        data_type = self.data_type
+        # Parsing: raw element string -> Python value
+        if data_type == "DT":
+            self.parse = _parse_date
+        elif data_type == "TM":
+            self.parse = _parse_time
+        elif data_type == "N0":
+            self.implied_decimals = 0
+            self.parse = _parse_integer
+        elif data_type.startswith("N"):
+            self.implied_decimals = int(data_type[-1])
+            self.parse = partial(_parse_decimal, 10**self.implied_decimals)
+        elif data_type == "R":
+            self.parse = _parse_real
+        else:
+            self.parse = str
+
+        # Formatting: Python value -> element string (before padding/trimming)
+        if data_type in ("AN", "ID"):
+            self.format = str
+        elif data_type == "DT":
+            if self.max_length == 8:
+                self.format = partial(_format_strftime, "%Y%m%d")
+            elif self.max_length == 6:
+                self.format = partial(_format_strftime, "%y%m%d")
+            else:
+                self.format = partial(_format_invalid, "Invalid length ({}) for date field in element '{}'".format(definition["length"], self.id))
+        elif data_type == "TM":
+            if self.max_length in (4, 6, 7, 8):
+                self.format = partial(_format_strftime, "%H%M")
+            else:
+                self.format = partial(_format_invalid, "Invalid length ({}) for time field in element '{}'".format(definition["length"], self.id))
+        elif data_type == "R":
+            self.format = _format_real
+        elif data_type.startswith("N"):
+            self.format = partial(_format_number, "{{:0{}.{}f}}".format(self.min_length, data_type[1:]))
+        elif data_type == "":
+            if self.id == "ISA16":
+                # Component Element Separator
+                self.format = str
+            else:
+                self.format = partial(_format_invalid, "Undefined behavior for empty data type with element '{}'".format(self.id))
+        else:
+            self.format = _format_empty
+
+class SegmentSchema(CompiledSchema):
+    """ A compiled segment definition """
+    __slots__ = ("id", "name", "req", "max_uses", "elements", "element_ids", "element_index", "element_parsers",
+                 "element_formatters", "mandatory", "syntax", "syntax_rules", "path", "record_class", "definition")
+    type = "segment"
+
+    def __init__(self, definition, path):
+        self.definition = definition
+        self.id = definition["id"]
+        self.path = path + "/" + self.id
+        # Generated on demand by pythonedi.records
+        self.record_class = None
+        self.name = definition["name"]
+        self.req = definition["req"]
+        self.max_uses = definition["max_uses"]
+        self.elements = tuple(ElementSchema(element) for element in definition["elements"])
+        self.element_ids = tuple(element.id for element in self.elements)
+        # Element ID -> position in the split segment (the segment ID is position 0)
+        self.element_index = {element_id: i+1 for i, element_id in enumerate(self.element_ids)}
+        self.element_parsers = tuple(element.parse for element in self.elements)
+        # Everything the generator needs per element, unpacked in one step
+        self.element_formatters = tuple(
+            (element, element.req, element.format, element.min_length, element.max_length, element.id == "ISA16")
+            for element in self.elements
+        )
+        # Positions of the mandatory elements in the split segment
+        self.mandatory = tuple(i+1 for i, element in enumerate(self.elements) if element.req == "M")
+        self.syntax = definition.get("syntax", [])
+        self.syntax_rules = compile_rules(self.syntax)
+
+class LoopSchema(CompiledSchema):
+    """ A compiled loop definition """
+    __slots__ = ("id", "name", "req", "repeat", "segments", "dispatch", "mandatory", "path", "record_class", "definition")
+    type = "loop"
+
+    def __init__(self, definition, path):
+        self.definition = definition
+        self.id = definition["id"]
+        self.path = path + "/" + self.id
+        self.record_class = None
+        self.name = definition["name"]
+        self.req = definition["req"]
+        self.repeat = definition["repeat"]
+        self.segments = compile_sections(definition["segments"], self.path)
+        self.dispatch = compile_dispatch(self.segments)
+        # Sections every iteration must include
+        self.mandatory = tuple(section for section in self.segments if section.req == "M")
+
+class FormatSchema(CompiledSchema):
+    """ A compiled transaction set definition """
+    __slots__ = ("name", "sections", "dispatch", "mandatory", "paths", "definition", "_digest")
+
+    def __init__(self, name, definition):
+        self.name = name
+        self.definition = definition
+        self._digest = None
+        self.sections = compile_sections(definition, name)
+        self.dispatch = compile_dispatch(self.sections)
+        # Sections every transaction set must include between its ST and SE
+        self.mandatory = tuple(section for section in self.sections
+                               if section.req == "M" and section.id not in ENVELOPE_SEGMENTS + ("ST", "SE"))
+        # Every segment and loop, keyed by its path (e.g. "810/L_IT1/IT1")
+        self.paths = {}
+        pending = list(self.sections)
+        while pending:
+            section = pending.pop()
+            self.paths[section.path] = section
+            if section.type == "loop":
+                pending.extend(section.segments)
+
+    def __iter__(self):
+        return iter(self.sections)
+
+    @property
+    def digest(self):
+        """ SHA-256 of the definition this schema was compiled from, telling
+        apart versions of a format with the same name (e.g. in parse cache keys) """
+        if self._digest is None:
+            import hashlib
+            import json
+            self._digest = hashlib.sha256(json.dumps(self.definition, sort_keys=True).encode("utf-8")).hexdigest()
+        return self._digest
+
+def compile_sections(definitions, path):
+    """ Compiles a list of segment/loop definitions found under `path` """
+    sections = []
+    for definition in definitions:
+        if definition["type"] == "loop":
+            sections.append(LoopSchema(definition, path))
+        else:
+            sections.append(SegmentSchema(definition, path))
+    return tuple(sections)
+
+def compile_dispatch(sections):
+    """ Returns the dispatch table of a loop (or top-level) context: segment
+    IDs mapped to the section they start there, a loop being started by its
+    first segment. Segment IDs a context does not define end it, handing the
+    segment back to the enclosing context. Where an ID could start several
+    sections, the first one listed wins. """
+    dispatch = {}
+    for section in sections:
+        opener = section
+        while opener.type == "loop":
+            opener = opener.segments[0]
+        dispatch.setdefault(opener.id, section)
+    return dispatch
+
+def section_matches(section, selectors):
+    """ Whether a compiled section is named by any of `selectors`: segment or
+    loop IDs ("IT1", "L_N1"), full paths ("810/REF") or trailing parts of
+    paths ("L_IT1/IT1") """
+    for selector in selectors:
+        if selector == section.id or selector == section.path or section.path.endswith("/" + selector):
+            return True
+    return False
+
+def skipped_paths(edi_format, include=None, exclude=None):
+    """ Returns the paths of the sections of a compiled format that a parse
+    limited by `include`/`exclude` selectors (see `section_matches`) leaves out.
+
+    Excluded sections are always left out. With `include`, a segment is kept
+    if it or a loop around it is included. Loops are kept if any segment
+    inside them is. """
+    skipped = set()
+
+    def visit(sections, included_above):
+        kept_any = False
+        for section in sections:
+            if exclude and section_matches(section, exclude):
+                skipped.add(section.path)
+                continue
+            included = include is None or included_above or section_matches(section, include)
+            if section.type == "loop":
+                # Loops are kept for whatever is kept inside them
+                keep = visit(section.segments, included)
+            else:
+                keep = included
+            if keep:
+                kept_any = True
+            else:
+                skipped.add(section.path)
+        return kept_any
+
+    visit(edi_format.sections, False)
+    return skipped
+
+_compiled_formats = {}
+
+# Directory of pickled compiled schemas (see `set_schema_cache`), if any
+_schema_cache = None
+
+def set_schema_cache(directory):
+    """ Keeps compiled schemas as pickles in `directory`, so later processes
+    (e.g. parse workers) load them instead of compiling the JSON definitions.
+    The PYTHONEDI_SCHEMA_CACHE environment variable sets a directory on import.
+    Pass None to stop using the cache. """
+    global _schema_cache
+    if directory is None:
+        _schema_cache = None
+        return
+    from .cache import SchemaCache
+    _schema_cache = SchemaCache(directory)
+
+def add_format_path(formats_path):
+    """ Makes the JSON definitions in `formats_path` available, replacing
+    same-named formats from the package or earlier paths """
+    for format_name in supported_formats.add_search_path(formats_path):
+        _compiled_formats.pop(format_name, None)
+
+def remove_format_path(formats_path):
+    """ Removes a directory added with `add_format_path` """
+    for format_name in supported_formats.remove_search_path(formats_path):
+        _compiled_formats.pop(format_name, None)
+
+def install_schemas(schemas):
+    """ Registers already-compiled formats, e.g. ones handed to a worker process """
+    _compiled_formats.update(schemas)
+
+def find_section(path):
+    """ Returns the compiled segment or loop at `path`, e.g. "810/L_IT1/IT1" """
+    return get_schema(path.split("/", 1)[0]).paths[path]
+
+def get_schema(format_name):
+    """ Returns the compiled schema for a supported format, compiling it on first use """
+    schema = _compiled_formats.get(format_name)
+    if schema is None:
+        if _schema_cache is not None and format_name in supported_formats:
+            schema = _schema_cache.load(format_name, supported_formats.paths[format_name], FormatSchema)
+        else:
+            schema = FormatSchema(format_name, supported_formats[format_name])
+        _compiled_formats[format_name] = schema
+    return schema
+
+if os.environ.get("PYTHONEDI_SCHEMA_CACHE"):
+    set_schema_cache(os.environ["PYTHONEDI_SCHEMA_CACHE"])
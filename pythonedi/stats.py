@@ -0,0 +1,99 @@
+"""
+Parser/generator instrumentation
+
+A Stats object collects per-segment counters and timings from an EDIParser or
+EDIGenerator it is handed to, and passes each event on to any connected
+callbacks (e.g. a metrics client). Parsers and generators without one skip
+the instrumentation entirely.
+"""
+
+EVENTS = ("segment", "loop", "unrecognized", "skipped")
+
+class Stats(object):
+    """ Counters and timings for everything parsed or built with it.
+
+    * `segments`: segment ID -> segments processed
+    * `segment_time`: segment ID -> seconds spent converting those segments
+    * `loops`: loop ID -> loop iterations processed
+    * `loop_time`: loop ID -> seconds spent converting segments inside that loop
+    * `unrecognized`: segments the parser found no definition for
+    * `skipped`: blank segments the parser passed over
+    * `bytes`: characters of EDI read or written, delimiters included
+      (the same as bytes for ASCII data)
+
+    Callbacks are attached with `connect(event, callback)` and called with:
+    `segment(segment_id, seconds)`, `loop(loop_id)`, `unrecognized(segment)`
+    and `skipped()`. """
+
+    def __init__(self):
+        self.hooks = {event: [] for event in EVENTS}
+        # Segment path -> IDs of the loops it sits in
+        self._enclosing_loops = {}
+        self.reset()
+
+    def reset(self):
+        """ Clears the counters, keeping connected callbacks """
+        self.segments = {}
+        self.segment_time = {}
+        self.loops = {}
+        self.loop_time = {}
+        self.unrecognized = 0
+        self.skipped = 0
+        self.bytes = 0
+
+    def connect(self, event, callback):
+        """ Calls `callback` on every `event` ("segment", "loop", "unrecognized" or "skipped") """
+        if event not in self.hooks:
+            raise ValueError("Unknown stats event '{}'. Valid events include: {}".format(event, ", ".join(EVENTS)))
+        self.hooks[event].append(callback)
+
+    def record_segment(self, segment_format, length, seconds):
+        """ Counts one converted segment of `length` characters """
+        segment_id = segment_format.id
+        self.segments[segment_id] = self.segments.get(segment_id, 0) + 1
+        self.segment_time[segment_id] = self.segment_time.get(segment_id, 0.0) + seconds
+        self.bytes += length
+        loops = self._enclosing_loops.get(segment_format.path)
+        if loops is None:
+            # "810/L_IT1/L_PID/PID" -> ("L_IT1", "L_PID")
+            loops = tuple(segment_format.path.split("/")[1:-1])
+            self._enclosing_loops[segment_format.path] = loops
+        for loop_id in loops:
+            self.loop_time[loop_id] = self.loop_time.get(loop_id, 0.0) + seconds
+        for callback in self.hooks["segment"]:
+            callback(segment_id, seconds)
+
+    def record_loop(self, loop_format):
+        """ Counts one loop iteration """
+        self.loops[loop_format.id] = self.loops.get(loop_format.id, 0) + 1
+        for callback in self.hooks["loop"]:
+            callback(loop_format.id)
+
+    def record_unrecognized(self, segment, length):
+        """ Counts a segment the parser had no definition for """
+        self.unrecognized += 1
+        self.bytes += length
+        for callback in self.hooks["unrecognized"]:
+            callback(segment)
+
+    def record_skipped(self, length):
+        """ Counts a blank segment """
+        self.skipped += 1
+        self.bytes += length
+        for callback in self.hooks["skipped"]:
+            callback()
+
+    def as_dict(self):
+        """ Returns the counters as plain data, e.g. for logging as JSON """
+        return {
+            "segments": dict(self.segments),
+            "segment_time": dict(self.segment_time),
+            "loops": dict(self.loops),
+            "loop_time": dict(self.loop_time),
+            "unrecognized": self.unrecognized,
+            "skipped": self.skipped,
+            "bytes": self.bytes,
+        }
+
+    def __repr__(self):
+        return "Stats({})".format(", ".join("{}={!r}".format(key, value) for key, value in self.as_dict().items()))
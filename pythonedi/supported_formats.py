@@ -3,18 +3,102 @@ Imports and manages EDI format definitions
 """
 
 import os
-import json
+from collections.abc import Mapping
+
+def parse_format(format_name, text):
+    """ Decodes a JSON format definition read as `text` (str or bytes) """
+    import json
+    format_def = json.loads(text)
+    if type(format_def) is not list:
+        raise TypeError("Imported definition {} is not a list of segments".format(format_name))
+    return format_def
+
+def load_format(format_path):
+    """ Reads a single JSON format definition """
+    format_name = os.path.basename(format_path)[:-5]
+    with open(format_path, "rb") as format_file:
+        return parse_format(format_name, format_file.read())
 
 def load_supported_formats(formats_path):
     supported_formats = {}
     for filename in os.listdir(formats_path):
         if filename.endswith(".json"):
             format_name = filename[:-5]
-            with open(os.path.join(formats_path, filename)) as format_file:
-                format_def = json.load(format_file)
-            if type(format_def) is not list:
-                raise TypeError("Imported definition {} is not a list of segments".format(format_name))
-            supported_formats[format_name] = format_def
+            supported_formats[format_name] = load_format(os.path.join(formats_path, filename))
     return supported_formats
 
-supported_formats = load_supported_formats(os.path.join(os.path.dirname(__file__), "formats"))
+class FormatRegistry(Mapping):
+    """ Read-only mapping of format names to definitions, found in a list of
+    directories of JSON files.
+
+    Only the directory listings are taken up front; each JSON definition is
+    read the first time it is looked up. When several directories define the
+    same format, the one added last wins, so a directory of partner-specific
+    variants can replace the package's own definitions. """
+
+    def __init__(self, *search_paths):
+        self.search_paths = list(search_paths)
+        self._paths = None
+        self._loaded = {}
+
+    def add_search_path(self, formats_path):
+        """ Adds a directory of definitions, returning the names of the formats it provides """
+        formats_path = os.path.abspath(formats_path)
+        # Listed before anything changes, so a missing directory is never registered
+        format_names = self._listing(formats_path)
+        if formats_path in self.search_paths:
+            self.search_paths.remove(formats_path)
+        self.search_paths.append(formats_path)
+        return self._reset(format_names)
+
+    def remove_search_path(self, formats_path):
+        """ Removes a directory added with `add_search_path`, returning the names of the formats it provided """
+        formats_path = os.path.abspath(formats_path)
+        self.search_paths.remove(formats_path)
+        return self._reset(self._listing(formats_path))
+
+    def _reset(self, format_names):
+        # Forget the listing and any definitions the change may replace
+        self._paths = None
+        for format_name in format_names:
+            self._loaded.pop(format_name, None)
+        return format_names
+
+    def _listing(self, formats_path):
+        return [filename[:-5] for filename in sorted(os.listdir(formats_path)) if filename.endswith(".json")]
+
+    @property
+    def paths(self):
+        """ Format names mapped to their definition files """
+        if self._paths is None:
+            paths = {}
+            for formats_path in self.search_paths:
+                for format_name in self._listing(formats_path):
+                    paths[format_name] = os.path.join(formats_path, format_name + ".json")
+            self._paths = paths
+        return self._paths
+
+    @property
+    def loaded(self):
+        """ Names of the formats read so far """
+        return list(self._loaded)
+
+    def __getitem__(self, format_name):
+        format_def = self._loaded.get(format_name)
+        if format_def is None:
+            if format_name not in self.paths:
+                raise KeyError(format_name)
+            format_def = load_format(self.paths[format_name])
+            self._loaded[format_name] = format_def
+        return format_def
+
+    def __contains__(self, format_name):
+        return format_name in self.paths
+
+    def __iter__(self):
+        return iter(self.paths)
+
+    def __len__(self):
+        return len(self.paths)
+
+supported_formats = FormatRegistry(os.path.join(os.path.dirname(__file__), "formats"))
@@ -0,0 +1,76 @@
+"""
+Segment syntax rules
+
+Compiles each segment's ATLEASTONE / ALLORNONE / IFATLEASTONE rules into
+bitmasks over element positions. Once a segment's element presence is known
+as a bitmask (bit n set when element n is not empty), checking a rule costs
+one or two integer operations.
+"""
+
+from .debug import Debug
+
+# Presence bits for element positions; position 0 is the segment ID
+_BITS = tuple(1 << position for position in range(256))
+
+def _mask(criteria):
+    mask = 0
+    for position in criteria:
+        mask |= 1 << position
+    return mask
+
+def compile_rules(syntax):
+    """ Compiles a segment's `syntax` list into `(rule, mask, trigger, definition)` tuples """
+    compiled = []
+    for rule in syntax:
+        criteria = rule["criteria"]
+        if rule["rule"] == "IFATLEASTONE":
+            # The first element triggers the rule; the others satisfy it
+            compiled.append((rule["rule"], _mask(criteria[1:]), _mask(criteria[:1]), rule))
+        else:
+            compiled.append((rule["rule"], _mask(criteria), 0, rule))
+    return tuple(compiled)
+
+def presence(fields):
+    """ Returns the presence bitmask of a split segment (segment ID first) """
+    present = 0
+    for bit, field in zip(_BITS, fields):
+        if field:
+            present |= bit
+    return present
+
+def iter_violations(rules, present):
+    """ Yields the definition of each compiled rule broken by `present` """
+    for rule, mask, trigger, definition in rules:
+        if rule == "ATLEASTONE": # At least one of the elements in `criteria` must be present
+            if not present & mask:
+                yield definition
+        elif rule == "ALLORNONE": # Either all the elements in `criteria` must be present, or none of them may be
+            found = present & mask
+            if found and found != mask:
+                yield definition
+        elif rule == "IFATLEASTONE": # If the first element in `criteria` is present, at least one of the others must be
+            if present & trigger and not present & mask:
+                yield definition
+
+def find_violation(rules, present):
+    """ Returns the definition of the first compiled rule broken by `present`, or None """
+    return next(iter_violations(rules, present), None)
+
+def describe_violation(segment_id, rule):
+    """ Returns the error message for a broken syntax rule """
+    criteria = rule["criteria"]
+    if rule["rule"] == "IFATLEASTONE":
+        first_element = "{}{:02d}".format(segment_id, criteria[0])
+        required_elements = ", ".join(["{}{:02d}".format(segment_id, e) for e in criteria[1:]])
+        return "Syntax error parsing segment {}: If {} is present, at least one of {} are required.".format(segment_id, first_element, required_elements)
+    required_elements = ", ".join(["{}{:02d}".format(segment_id, e) for e in criteria])
+    if rule["rule"] == "ATLEASTONE":
+        return "Syntax error parsing segment {}: At least one of {} is required.".format(segment_id, required_elements)
+    return "Syntax error parsing segment {}: If one of {} is present, all are required.".format(segment_id, required_elements)
+
+def check_syntax(segment, present):
+    """ Raises ValueError if the presence bitmask breaks one of a compiled segment's rules """
+    rule = find_violation(segment.syntax_rules, present)
+    if rule is not None:
+        Debug.explain(segment.definition)
+        raise ValueError(describe_violation(segment.id, rule))
@@ -0,0 +1,60 @@
+""" Import-time test cases for PythonEDI """
+
+import json
+import statistics
+import subprocess
+import sys
+import time
+import unittest
+
+# `import pythonedi` may add at most this fraction of a bare interpreter's
+# start-up time. Both are measured on the same machine, so the check holds on
+# slow and fast ones alike; the import adds about half of it.
+IMPORT_TIME_RATIO = 1.0
+IMPORT_TIME_RUNS = 5
+
+# Modules only needed by optional features, which must not load on import
+DEFERRED_MODULES = (
+    "colorama", "multiprocessing", "concurrent.futures.process", "pickle", "hashlib",
+    "pythonedi.acknowledgments", "pythonedi.cache", "pythonedi.columns", "pythonedi.events",
+    "pythonedi.lazy", "pythonedi.push", "pythonedi.records", "pythonedi.stats",
+)
+
+PROBE = """
+import json, sys
+import pythonedi
+print(json.dumps({
+    "loaded_formats": pythonedi.supported_formats.loaded,
+    "deferred_loaded": [name for name in %r if name in sys.modules],
+}))
+"""
+
+def start_up_time(code):
+    """ Median wall time of a fresh interpreter running `code` """
+    times = []
+    for _ in range(IMPORT_TIME_RUNS):
+        start = time.perf_counter()
+        subprocess.check_call([sys.executable, "-c", code])
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+class TestImport(unittest.TestCase):
+    """ Tests that importing the package stays cheap """
+    def setUp(self):
+        output = subprocess.check_output([sys.executable, "-c", PROBE % (DEFERRED_MODULES,)])
+        self.probe = json.loads(output.decode())
+
+    def test_import_time(self):
+        bare = start_up_time("pass")
+        extra = start_up_time("import pythonedi") - bare
+        self.assertLess(extra, bare * IMPORT_TIME_RATIO)
+
+    def test_formats_load_on_first_use(self):
+        self.assertEqual(self.probe["loaded_formats"], [])
+
+    def test_optional_modules_deferred(self):
+        self.assertEqual(self.probe["deferred_loaded"], [])
+
+    def test_lazy_attributes(self):
+        output = subprocess.check_output([sys.executable, "-c", "import pythonedi; print(pythonedi.PushParser.__module__)"])
+        self.assertEqual(output.decode().strip(), "pythonedi.push")
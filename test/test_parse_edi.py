@@ -1,8 +1,23 @@
 """ Parsing test cases for PythonEDI """
 
+import contextlib
+import importlib.util
+import io
+import json
+import math
+import os
+import pickle
+import random
+import re
+import shutil
+import tempfile
 import unittest
+from datetime import datetime
 import pprint
 import pythonedi
+from pythonedi.EDIParser import detect_delimiters
+from pythonedi.lazy import LazySegment
+from pythonedi.supported_formats import supported_formats
 
 class TestParse810(unittest.TestCase):
     """ Tests the Parser module """
@@ -16,3 +31,663 @@ class TestParse810(unittest.TestCase):
             print("\n\n{}".format(found_segments))
             print("\n\n")
             pprint.pprint(edi_data)
+
+    def test_parse_line_items(self):
+        with open("test/test_edi.txt", "r") as test_edi_file:
+            found_segments, edi_data = self.parser.parse(test_edi_file.read())
+        self.assertEqual(found_segments[:3], ["ISA", "GS", "ST"])
+        self.assertEqual(len(edi_data["L_IT1"]), 124)
+        self.assertEqual(edi_data["L_IT1"][0]["IT1"]["IT107"], "165911")
+        self.assertEqual(edi_data["L_IT1"][-1]["L_PID"][0]["PID"]["PID05"], "UNIT BLOOD PRESSURE LARGEADULT")
+        self.assertEqual(edi_data["TDS"]["TDS01"], 24669.39)
+
+    def test_iter_parse(self):
+        with open("test/test_edi.txt", "r") as test_edi_file:
+            test_edi = test_edi_file.read()
+        found_segments, edi_data = self.parser.parse(test_edi)
+        # A tiny chunk size forces segments to straddle chunk boundaries
+        sections = list(self.parser.iter_parse(io.StringIO(test_edi), chunk_size=7))
+        self.assertEqual([name for name, _ in sections], found_segments)
+        self.assertEqual(dict(sections), edi_data)
+
+    def test_parse_batch(self):
+        with open("test/test_edi.txt", "r") as test_edi_file:
+            lines = test_edi_file.read().split("\n")
+        envelope, transaction, trailer = lines[:2], lines[2:-3], lines[-3:]
+        second = [line.replace("ST^810^0001", "ST^810^0002") for line in transaction]
+        second_group = ["GS^IN^SENECA^068717859^20170311^1102^5815^X^004010"] + transaction + ["GE^1^5815"]
+        batch = "\n".join(envelope + transaction + second + ["GE^2^5814"] + second_group + ["IEA^2^000005814"] + lines)
+
+        interchanges = self.parser.parse_batch(batch)
+        self.assertEqual(len(interchanges), 2)
+        groups = interchanges[0]["groups"]
+        self.assertEqual([len(group["transactions"]) for group in groups], [2, 1])
+        self.assertEqual([t["ST"]["ST02"] for t in groups[0]["transactions"]], ["0001", "0002"])
+        self.assertEqual(groups[0]["GE"]["GE01"], 2)
+        self.assertEqual(interchanges[0]["IEA"]["IEA01"], 2)
+        self.assertEqual(len(groups[0]["transactions"][1]["L_IT1"]), 124)
+
+        contexts = [(i["ISA"]["ISA13"], g["GS"]["GS06"]) for i, g, _ in self.parser.iter_transactions(batch)]
+        self.assertEqual(contexts, [(5814, 5814), (5814, 5814), (5814, 5815), (5814, 5814)])
+
+class TestAutodetect(unittest.TestCase):
+    """ Tests delimiter and transaction set autodetection """
+    def setUp(self):
+        self.parser = pythonedi.EDIParser()
+        with open("test/test_edi.txt", "r") as test_edi_file:
+            self.test_edi = test_edi_file.read()
+
+    def test_detect_delimiters(self):
+        self.assertEqual(detect_delimiters(self.test_edi), ("^", "\n", "|"))
+        tilde = self.test_edi.replace("^", "*").replace("\n", "~\r\n")
+        self.assertEqual(detect_delimiters(tilde), ("*", "~\r\n", "|"))
+        self.assertIsNone(detect_delimiters("ST^810^0001"))
+
+    def test_parse_without_format(self):
+        expected = pythonedi.EDIParser(edi_format="810").parse(self.test_edi)
+        tilde = self.test_edi.replace("^", "*").replace("\n", "~")
+        self.assertEqual(self.parser.parse(tilde), expected)
+
+    def test_interleaved_parse(self):
+        # Delimiters belong to each message, not to the parser
+        lines = self.test_edi.split("\n")
+        batch = "\n".join(lines[:-3] + lines[2:])
+        tilde = self.test_edi.replace("^", "*").replace("\n", "~")
+        for mode in ({}, {"lazy": True}):
+            parser = pythonedi.EDIParser(**mode)
+            transactions = parser.iter_transactions(batch)
+            next(transactions)
+            self.assertEqual(parser.parse(tilde)[1]["BIG"]["BIG02"], "12973821")
+            interchange, group, transaction = next(transactions)
+            self.assertEqual(transaction["BIG"]["BIG02"], "12973821")
+            self.assertEqual(transaction["SE"]["SE02"], "0001")
+            self.assertEqual(list(transactions), [])
+
+    def test_mixed_transaction_types(self):
+        lines = self.test_edi.split("\n")
+        purchase_order = ["ST^850^0002", "BEG^00^SA^PO-1^^20170310", "PO1^1^10^EA^5.5^^VC^ABC", "CTT^1", "SE^5^0002"]
+        mixed = "\n".join(lines[:-3] + purchase_order + lines[-3:])
+        transactions = self.parser.parse_batch(mixed)[0]["groups"][0]["transactions"]
+        self.assertEqual([t["ST"]["ST01"] for t in transactions], ["810", "850"])
+        self.assertEqual(len(transactions[0]["L_IT1"]), 124)
+        self.assertEqual(transactions[1]["L_PO1"][0]["PO1"]["PO102"], 10.0)
+
+class TestLazyParse(unittest.TestCase):
+    """ Tests lazy segment views """
+    def setUp(self):
+        with open("test/test_edi.txt", "r") as test_edi_file:
+            self.test_edi = test_edi_file.read()
+
+    def test_lazy_matches_eager(self):
+        eager = pythonedi.EDIParser(edi_format="810").parse(self.test_edi)
+        lazy = pythonedi.EDIParser(edi_format="810", lazy=True).parse(self.test_edi)
+        self.assertEqual(lazy, eager)
+
+    def test_elements_convert_on_access(self):
+        _, edi_data = pythonedi.EDIParser(edi_format="810", lazy=True).parse(self.test_edi)
+        big = edi_data["BIG"]
+        self.assertIsInstance(big, LazySegment)
+        self.assertIsNone(big._fields)
+        self.assertEqual(big["BIG02"], "12973821")
+        self.assertEqual(list(big._values), ["BIG02"])
+        self.assertIs(big["BIG02"], big["BIG02"])
+        self.assertEqual(edi_data["TDS"]["TDS01"], 24669.39)
+        with self.assertRaises(KeyError):
+            edi_data["TDS"]["TDS02"]
+
+class TestRecordParse(unittest.TestCase):
+    """ Tests generated __slots__ record output """
+    def setUp(self):
+        with open("test/test_edi.txt", "r") as test_edi_file:
+            self.test_edi = test_edi_file.read()
+        _, self.edi_data = pythonedi.EDIParser(edi_format="810", records=True).parse(self.test_edi)
+
+    def test_records_match_dicts(self):
+        _, expected = pythonedi.EDIParser(edi_format="810").parse(self.test_edi)
+        self.assertEqual(self.edi_data, expected)
+
+    def test_record_access(self):
+        line_item = self.edi_data["L_IT1"][0]
+        self.assertFalse(hasattr(line_item, "__dict__"))
+        self.assertEqual(line_item.IT1.IT102, 4.0)
+        self.assertEqual(line_item["IT1"]["IT103"], "BG")
+        self.assertNotIn("TXI", line_item)
+        with self.assertRaises(KeyError):
+            line_item["TXI"]
+
+    def test_id_codes_interned(self):
+        units = [line_item.IT1.IT105 for line_item in self.edi_data["L_IT1"]]
+        self.assertTrue(all(unit is units[0] for unit in units))
+
+    def test_records_pickle(self):
+        self.assertEqual(pickle.loads(pickle.dumps(self.edi_data)), self.edi_data)
+
+class TestParseMany(unittest.TestCase):
+    """ Tests process-pool parsing of many messages """
+    def setUp(self):
+        self.parser = pythonedi.EDIParser(edi_format="810")
+        with open("test/test_edi.txt", "r") as test_edi_file:
+            self.test_edi = test_edi_file.read()
+        self.expected = self.parser.parse(self.test_edi)
+        self.items = [self.test_edi, "test/test_edi.txt", self.test_edi.encode()] * 3
+
+    def test_ordered(self):
+        results = list(self.parser.parse_many(self.items, workers=2, chunksize=2))
+        self.assertEqual(results, [self.expected] * len(self.items))
+
+    def test_as_completed(self):
+        results = sorted(self.parser.parse_many(self.items, workers=2, ordered=False, chunksize=4))
+        self.assertEqual([index for index, _ in results], list(range(len(self.items))))
+        self.assertTrue(all(result == self.expected for _, result in results))
+
+    def test_in_process(self):
+        results = list(pythonedi.EDIParser(lazy=True).parse_many(self.items, workers=1))
+        self.assertEqual(results, [self.expected] * len(self.items))
+
+    def test_worker_settings(self):
+        # Workers are sent settings only, never a parser mid-way through a file
+        self.parser.parse_file("test/test_edi.txt")
+        settings = pickle.loads(pickle.dumps(self.parser.worker_settings()))
+        self.assertEqual(pythonedi.EDIParser(**settings).parse(self.test_edi), self.expected)
+
+    def test_bounded_read_ahead(self):
+        consumed = []
+        def items():
+            for item in self.items:
+                consumed.append(item)
+                yield item
+        results = self.parser.parse_many(items(), workers=2, chunksize=1)
+        self.assertEqual(next(results), self.expected)
+        # Two chunks per worker are read ahead of the first result
+        self.assertEqual(len(consumed), 4)
+        self.assertEqual(len(list(results)), len(self.items) - 1)
+
+    def test_worker_cache(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        parser = pythonedi.EDIParser(edi_format="810", cache=pythonedi.ParseCache(max_entries=4, directory=directory))
+        parser.parse(self.test_edi)
+        settings = pickle.loads(pickle.dumps(parser.worker_settings()))
+        cache = settings["cache"]
+        self.assertEqual((len(cache._memory), cache.max_entries, cache.directory), (0, 4, directory))
+        # The worker's parser finds the parent's result in the shared directory
+        self.assertEqual(pythonedi.EDIParser(**settings).parse(self.test_edi), self.expected)
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+
+    def test_collectors_rejected(self):
+        for collector in ({"stats": True}, {"diagnostics": pythonedi.Diagnostics()}, {"acknowledgments": pythonedi.Acknowledgments()}):
+            with self.assertRaises(ValueError):
+                list(pythonedi.EDIParser(**collector).parse_many(self.items, workers=2))
+
+class TestParseFile(unittest.TestCase):
+    """ Tests memory-mapped file parsing """
+    def test_parse_file_matches_parse(self):
+        parser = pythonedi.EDIParser(edi_format="810")
+        with open("test/test_edi.txt", "r") as test_edi_file:
+            expected = parser.parse(test_edi_file.read())
+        self.assertEqual(parser.parse_file("test/test_edi.txt"), expected)
+        self.assertEqual(pythonedi.EDIParser(lazy=True).parse_file("test/test_edi.txt"), expected)
+
+    def test_parse_empty_file(self):
+        with tempfile.NamedTemporaryFile(suffix=".edi") as empty_file:
+            self.assertEqual(pythonedi.EDIParser(edi_format="810").parse_file(empty_file.name), ([], {}))
+
+class TestValidate(unittest.TestCase):
+    """ Tests syntax-rule validation while parsing """
+    def setUp(self):
+        with open("test/test_edi.txt", "r") as test_edi_file:
+            self.test_edi = test_edi_file.read()
+        self.old_level = pythonedi.Debug.level
+        pythonedi.Debug.level = 0 # Turn off explaining for intentional exceptions
+
+    def tearDown(self):
+        pythonedi.Debug.level = self.old_level
+
+    def test_valid_message(self):
+        expected = pythonedi.EDIParser(edi_format="810").parse(self.test_edi)
+        self.assertEqual(pythonedi.EDIParser(edi_format="810", validate=True).parse(self.test_edi), expected)
+
+    def test_rule_violations(self):
+        for original, broken in (("REF^OQ^500100566875", "REF^OQ"), # ATLEASTONE
+                                 ("ITD^^3^^^^", "ITD^^3^5^^^"), # IFATLEASTONE
+                                 ("IT1^1^4^BG^", "IT1^1^4^^")): # ALLORNONE
+            for mode in ({}, {"lazy": True}, {"records": True}):
+                parser = pythonedi.EDIParser(edi_format="810", validate=True, **mode)
+                with self.assertRaisesRegex(ValueError, "Syntax error parsing segment " + broken[:3]):
+                    parser.parse(self.test_edi.replace(original, broken, 1))
+            # Not checked unless asked for
+            pythonedi.EDIParser(edi_format="810").parse(self.test_edi.replace(original, broken, 1))
+
+class TestParseStats(unittest.TestCase):
+    """ Tests parser instrumentation """
+    def setUp(self):
+        with open("test/test_edi.txt", "r") as test_edi_file:
+            self.test_edi = test_edi_file.read()
+
+    def test_counters(self):
+        stats = pythonedi.Stats()
+        unrecognized = []
+        stats.connect("unrecognized", unrecognized.append)
+        parser = pythonedi.EDIParser(edi_format="810", stats=stats)
+        old_level = pythonedi.Debug.level
+        pythonedi.Debug.level = 0
+        try:
+            found_segments, edi_data = parser.parse(self.test_edi.replace("\nTDS^", "\nZZZ^1\n\nTDS^", 1))
+        finally:
+            pythonedi.Debug.level = old_level
+        self.assertEqual(stats.segments["IT1"], 124)
+        self.assertEqual(stats.loops["L_IT1"], 124)
+        self.assertEqual(stats.loops["L_PID"], 124)
+        self.assertGreater(stats.loop_time["L_IT1"], stats.loop_time["L_PID"])
+        self.assertEqual(unrecognized, ["ZZZ^1"])
+        clean = pythonedi.Stats()
+        pythonedi.EDIParser(edi_format="810", stats=clean).parse(self.test_edi)
+        self.assertEqual(stats.skipped, clean.skipped + 1)
+        self.assertGreaterEqual(stats.bytes, len(self.test_edi))
+        # Instrumentation does not change the result
+        self.assertEqual(edi_data, pythonedi.EDIParser(edi_format="810").parse(self.test_edi)[1])
+
+    def test_disabled(self):
+        parser = pythonedi.EDIParser(edi_format="810")
+        self.assertIsNone(parser.stats)
+        self.assertEqual(parser.build_segment.__func__, pythonedi.EDIParser.build_segment)
+
+class EventRecorder(pythonedi.EventHandler):
+    def __init__(self):
+        self.events = []
+
+    def start_transaction(self, segment):
+        self.events.append(("start_transaction", segment["ST01"]))
+
+    def end_transaction(self, segment):
+        self.events.append(("end_transaction", segment["SE02"]))
+
+    def start_loop(self, loop):
+        self.events.append(("start_loop", loop.id))
+
+    def end_loop(self, loop):
+        self.events.append(("end_loop", loop.id))
+
+    def segment(self, segment):
+        self.events.append(("segment", segment.schema.path))
+
+class TestEventParse(unittest.TestCase):
+    """ Tests the event-driven parser """
+    def setUp(self):
+        with open("test/test_edi.txt", "r") as test_edi_file:
+            self.test_edi = test_edi_file.read()
+
+    def test_events(self):
+        events = pythonedi.EDIParser(edi_format="810").parse_events(self.test_edi, EventRecorder()).events
+        self.assertEqual(events[:4], [("segment", "810/ISA"), ("segment", "810/GS"), ("start_transaction", "810"), ("segment", "810/ST")])
+        self.assertEqual(events[-4:], [("segment", "810/SE"), ("end_transaction", "0001"), ("segment", "810/GE"), ("segment", "810/IEA")])
+        self.assertEqual(events.count(("start_loop", "L_IT1")), 124)
+        self.assertEqual(events.count(("end_loop", "L_IT1")), 124)
+        self.assertEqual(events[events.index(("segment", "810/L_IT1/IT1")):][:5], [
+            ("segment", "810/L_IT1/IT1"), ("start_loop", "L_PID"), ("segment", "810/L_IT1/L_PID/PID"),
+            ("end_loop", "L_PID"), ("end_loop", "L_IT1"),
+        ])
+
+    def test_autodetect_stream(self):
+        events = pythonedi.EDIParser().parse_events(io.StringIO(self.test_edi), EventRecorder()).events
+        segments = [event for event in events if event[0] == "segment"]
+        self.assertEqual(segments[0], ("segment", "envelope/ISA"))
+        self.assertEqual(len(segments), len([line for line in self.test_edi.splitlines() if line]))
+        self.assertEqual(segments[3], ("segment", "810/BIG"))
+
+class TestParseColumns(unittest.TestCase):
+    """ Tests columnar extraction """
+    def setUp(self):
+        with open("test/test_edi.txt", "r") as test_edi_file:
+            self.test_edi = test_edi_file.read()
+        self.parser = pythonedi.EDIParser(edi_format="810")
+
+    def test_columns_match_parse(self):
+        columns = self.parser.parse_columns(self.test_edi, "L_IT1/IT1")
+        line_items = [item["IT1"] for item in self.parser.parse(self.test_edi)[1]["L_IT1"]]
+        self.assertEqual(len(columns), 124)
+        self.assertEqual(columns.columns["IT102"].typecode, "d")
+        self.assertEqual(list(columns.columns["IT102"]), [item["IT102"] for item in line_items])
+        self.assertEqual(columns.columns["IT101"], [item["IT101"] for item in line_items])
+
+    def test_collect_many(self):
+        columns = self.parser.parse_columns(self.test_edi, "L_IT1/IT1")
+        pythonedi.EDIParser().parse_columns(self.test_edi, "810/L_IT1/IT1", columns)
+        self.assertEqual(len(columns), 248)
+        self.assertEqual(list(columns.transactions[122:126]), [0, 0, 1, 1])
+
+    def test_missing_values(self):
+        test_edi = self.test_edi.replace("IT1^1^4^BG^25.6000^CT^VC^165911^IN^000018^MG^365985", "IT1^1^^^25.6000", 1)
+        columns = self.parser.parse_columns(test_edi, "L_IT1/IT1")
+        self.assertTrue(math.isnan(columns.columns["IT102"][0]))
+        self.assertEqual(columns.columns["IT104"][0], 25.6)
+        # Elements left off the end of the segment
+        self.assertEqual([columns.columns["IT111"][0], columns.columns["IT111"][1]], [None, "7086"])
+
+    def test_missing_mandatory_count(self):
+        # CTT01 is a mandatory N0: left empty, it is NaN rather than 0
+        columns = self.parser.parse_columns(self.test_edi.replace("CTT^", "CTT^^", 1), "CTT")
+        self.assertEqual(columns.columns["CTT01"].typecode, "d")
+        self.assertTrue(math.isnan(columns.columns["CTT01"][0]))
+
+    def test_loop_path(self):
+        with self.assertRaises(ValueError):
+            self.parser.parse_columns(self.test_edi, "L_IT1")
+
+    @unittest.skipUnless(importlib.util.find_spec("numpy"), "NumPy is not installed")
+    def test_to_numpy(self):
+        arrays = self.parser.parse_columns(self.test_edi, "L_IT1/IT1").to_numpy()
+        self.assertEqual(arrays["IT102"].dtype.kind, "f")
+        self.assertEqual(arrays["IT101"].shape, (124,))
+
+class TestParseCache(unittest.TestCase):
+    """ Tests the parse result cache """
+    def setUp(self):
+        with open("test/test_edi.txt", "r") as test_edi_file:
+            self.test_edi = test_edi_file.read()
+        self.expected = pythonedi.EDIParser(edi_format="810").parse(self.test_edi)
+
+    def test_memory_tier(self):
+        cache = pythonedi.ParseCache(max_entries=1)
+        parser = pythonedi.EDIParser(edi_format="810", cache=cache)
+        first = parser.parse(self.test_edi)
+        self.assertEqual(first, self.expected)
+        self.assertIs(parser.parse(self.test_edi), first)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        # Different settings or content are separate entries
+        pythonedi.EDIParser(edi_format="810", records=True, cache=cache).parse(self.test_edi)
+        self.assertEqual(cache.misses, 2)
+        # ...and the oldest entry is evicted
+        self.assertIsNot(parser.parse(self.test_edi), first)
+
+    def test_collectors_bypass_cache(self):
+        cache = pythonedi.ParseCache()
+        broken = self.test_edi.replace("\nBIG^", "\nZZZ^1\nBIG^", 1)
+        for _ in range(2):
+            diagnostics = pythonedi.Diagnostics()
+            pythonedi.EDIParser(edi_format="810", cache=cache, diagnostics=diagnostics).parse(broken)
+            self.assertEqual(len(diagnostics), 1)
+        self.assertEqual((cache.hits, cache.misses), (0, 0))
+
+    def test_shared_directory(self):
+        with tempfile.TemporaryDirectory() as directory:
+            parser = pythonedi.EDIParser(edi_format="810", cache=pythonedi.ParseCache(directory=directory))
+            results = list(parser.parse_many([self.test_edi] * 8, workers=4, chunksize=1))
+            self.assertEqual(results, [self.expected] * 8)
+            self.assertEqual([name for name in os.listdir(directory) if name.endswith(".tmp")], [])
+
+    def test_disk_tier(self):
+        with tempfile.TemporaryDirectory() as directory:
+            parser = pythonedi.EDIParser(edi_format="810", cache=pythonedi.ParseCache(directory=directory))
+            parser.parse(self.test_edi)
+            cache = pythonedi.ParseCache(directory=directory)
+            self.assertEqual(pythonedi.EDIParser(edi_format="810", cache=cache).parse(self.test_edi), self.expected)
+            self.assertEqual(cache.hits, 1)
+            self.assertEqual(pythonedi.EDIParser(edi_format="810", cache=cache).parse_file("test/test_edi.txt"), self.expected)
+
+    def test_changed_definition(self):
+        with tempfile.TemporaryDirectory() as directory:
+            pythonedi.EDIParser(edi_format="810", cache=pythonedi.ParseCache(directory=directory)).parse(self.test_edi)
+            pythonedi.EDIParser(cache=pythonedi.ParseCache(directory=directory)).parse(self.test_edi)
+            with open(supported_formats.paths["810"]) as format_file:
+                definition = json.load(format_file)
+            for section in definition:
+                if section["id"] == "BIG":
+                    section["elements"][1]["id"] = "BIG02X"
+            formats_path = os.path.join(directory, "formats")
+            os.mkdir(formats_path)
+            with open(os.path.join(formats_path, "810.json"), "w") as format_file:
+                json.dump(definition, format_file)
+            pythonedi.add_format_path(formats_path)
+            try:
+                for edi_format in ("810", None):
+                    cache = pythonedi.ParseCache(directory=directory)
+                    found_segments, transaction = pythonedi.EDIParser(edi_format=edi_format, cache=cache).parse(self.test_edi)
+                    self.assertEqual((cache.hits, cache.misses), (0, 1))
+                    self.assertIn("BIG02X", transaction["BIG"])
+            finally:
+                pythonedi.remove_format_path(formats_path)
+
+    def test_disk_eviction(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = pythonedi.ParseCache(directory=directory, max_disk_bytes=1)
+            pythonedi.EDIParser(edi_format="810", cache=cache).parse(self.test_edi)
+            self.assertEqual(os.listdir(directory), [])
+
+class TestSelectiveParse(unittest.TestCase):
+    """ Tests parsing only some sections """
+    def setUp(self):
+        with open("test/test_edi.txt", "r") as test_edi_file:
+            self.test_edi = test_edi_file.read()
+        self.parser = pythonedi.EDIParser(edi_format="810")
+        self.expected = self.parser.parse(self.test_edi)[1]
+
+    def test_include(self):
+        found_segments, edi_data = self.parser.parse(self.test_edi, include=["BIG", "810/REF", "L_N1", "TDS", "CTT"])
+        self.assertEqual(found_segments, ["BIG", "REF", "L_N1", "TDS", "CTT"])
+        for key in found_segments:
+            self.assertEqual(edi_data[key], self.expected[key])
+
+    def test_include_nested(self):
+        found_segments, edi_data = self.parser.parse(self.test_edi, include=["L_IT1/L_PID"])
+        self.assertEqual(found_segments, ["L_IT1"])
+        self.assertEqual(edi_data["L_IT1"], [{"L_PID": item["L_PID"]} for item in self.expected["L_IT1"]])
+
+    def test_exclude(self):
+        found_segments, edi_data = self.parser.parse(self.test_edi, exclude=["PID", "ITD"])
+        self.assertNotIn("ITD", found_segments)
+        self.assertEqual(edi_data["L_IT1"], [{"IT1": item["IT1"]} for item in self.expected["L_IT1"]])
+        self.assertEqual(edi_data["CTT"], self.expected["CTT"])
+
+    def test_skipped_sections_not_split(self):
+        # Left-out segments would fail to parse if they were split
+        broken = self.test_edi.replace("PID^F^^^^", "PID^F^^^^^^^^^^^^^^^^^^^^")
+        edi_data = self.parser.parse(broken, exclude=["L_IT1/L_PID"])[1]
+        self.assertEqual(len(edi_data["L_IT1"]), 124)
+
+    def test_autodetect(self):
+        found_segments, edi_data = pythonedi.EDIParser().parse(self.test_edi, include=["BIG", "IEA"])
+        self.assertEqual(found_segments, ["BIG", "IEA"])
+        # The selection only lasts for one call
+        self.assertEqual(len(pythonedi.EDIParser().parse(self.test_edi)[0]), len(self.expected))
+
+class TestPushParse(unittest.TestCase):
+    """ Tests feeding the parser chunk by chunk """
+    def setUp(self):
+        with open("test/test_edi.txt", "r") as test_edi_file:
+            lines = test_edi_file.read().split("\n")
+        envelope, transaction, trailer = lines[:2], lines[2:-3], lines[-3:]
+        second = [line.replace("ST^810^0001", "ST^810^0002") for line in transaction]
+        self.stream = "\n".join(envelope + transaction + second + trailer)
+        self.expected = list(pythonedi.EDIParser().iter_transactions(self.stream))
+
+    def test_random_chunks(self):
+        data = self.stream.encode("utf-8")
+        chunks = random.Random(0)
+        for parser in (pythonedi.PushParser(), pythonedi.PushParser(pythonedi.EDIParser(edi_format="810"))):
+            results = []
+            position = 0
+            while position < len(data):
+                size = chunks.randint(1, 300)
+                results.extend(parser.feed(data[position:position+size]))
+                position += size
+            results.extend(parser.close())
+            self.assertEqual(results, self.expected)
+
+    def test_transaction_ready_at_se(self):
+        parser = pythonedi.PushParser()
+        first_se = self.stream.index("\nSE^") + 1
+        self.assertEqual(parser.feed(self.stream[:first_se]), [])
+        end_of_se = self.stream.index("\n", first_se) + 1
+        finished = parser.feed(self.stream[first_se:end_of_se])
+        self.assertEqual([t["ST"]["ST02"] for i, g, t in finished], ["0001"])
+        finished = parser.feed(self.stream[end_of_se:]) + parser.close()
+        self.assertEqual([t["ST"]["ST02"] for i, g, t in finished], ["0002"])
+        self.assertEqual(finished[0][0]["IEA"]["IEA01"], 1)
+
+    def test_split_multibyte_character(self):
+        stream = self.stream.replace("SENECA MEDICAL LLC", "SÉNECA MEDICAL LLC").encode("utf-8")
+        split = stream.index("\xc3".encode("latin-1")) + 1
+        parser = pythonedi.PushParser()
+        finished = parser.feed(stream[:split]) + parser.feed(stream[split:]) + parser.close()
+        self.assertEqual(finished[0][2]["L_N1"][0]["N1"]["N102"], "SÉNECA MEDICAL LLC")
+
+class TestDiagnostics(unittest.TestCase):
+    """ Tests collecting parse problems instead of printing them """
+    def setUp(self):
+        with open("test/test_edi.txt", "r") as test_edi_file:
+            self.test_edi = test_edi_file.read()
+
+    def test_unrecognized_segment(self):
+        broken = self.test_edi.replace("\nBIG^", "\nZZZ^1\nBIG^", 1)
+        for mode in ({}, {"lazy": True}, {"records": True}):
+            diagnostics = pythonedi.Diagnostics()
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                pythonedi.EDIParser(edi_format="810", diagnostics=diagnostics, **mode).parse(broken)
+            self.assertEqual(output.getvalue(), "")
+            self.assertEqual([(d.code, d.position, d.segment_id) for d in diagnostics], [("unrecognized_segment", 3, "ZZZ")])
+            self.assertEqual(diagnostics.render(), "Segment #4: Unrecognized segment ZZZ")
+
+    def test_too_many_elements_lazy(self):
+        broken = self.test_edi.replace("\nCTT^124\n", "\nCTT^124^1^1\n")
+        parser = pythonedi.EDIParser(edi_format="810", lazy=True, diagnostics=pythonedi.Diagnostics())
+        for parse in (parser.parse, lambda data: parser.parse_events(data, pythonedi.EventHandler())):
+            parser.diagnostics.clear()
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output), self.assertRaises(TypeError):
+                parse(broken)
+            self.assertEqual(output.getvalue(), "")
+            self.assertEqual([(d.code, d.path) for d in parser.diagnostics], [("too_many_elements", "810/CTT")])
+
+    def test_invalid_element(self):
+        broken = self.test_edi.replace("\nBIG^20170310^", "\nBIG^2017XX10^", 1)
+        for mode in ({}, {"records": True}):
+            diagnostics = pythonedi.Diagnostics()
+            with self.assertRaisesRegex(ValueError, "BIG01"):
+                pythonedi.EDIParser(edi_format="810", diagnostics=diagnostics, **mode).parse(broken)
+            self.assertEqual([(d.code, d.position, d.element_id, d.detail) for d in diagnostics], [("invalid_element", 3, "BIG01", "DT")])
+        diagnostics = pythonedi.Diagnostics()
+        found_segments, transaction = pythonedi.EDIParser(edi_format="810", lazy=True, diagnostics=diagnostics).parse(broken)
+        with self.assertRaisesRegex(ValueError, "position 3"):
+            transaction["BIG"]["BIG01"]
+        self.assertEqual([(d.code, d.position, d.element_id) for d in diagnostics], [("invalid_element", 3, "BIG01")])
+
+    def test_validate_collects_violations(self):
+        broken = self.test_edi.replace("REF^OQ^500100566875", "REF^OQ", 1).replace("IT1^1^4^BG^", "IT1^1^4^^", 1)
+        diagnostics = pythonedi.Diagnostics()
+        found_segments, transaction = pythonedi.EDIParser(edi_format="810", validate=True, diagnostics=diagnostics).parse(broken)
+        self.assertEqual(transaction["REF"][0]["REF01"], "OQ")
+        self.assertEqual([(d.segment_id, d.path, d.detail) for d in diagnostics],
+                         [("REF", "810/REF", "ATLEASTONE"), ("IT1", "810/L_IT1/IT1", "ALLORNONE")])
+        self.assertEqual(diagnostics.counts(), {"syntax_rule": 2})
+
+    def test_push_positions(self):
+        stream = self.test_edi.replace("\nBIG^", "\nZZZ^1\nBIG^", 1)
+        diagnostics = pythonedi.Diagnostics()
+        parser = pythonedi.PushParser(pythonedi.EDIParser(edi_format="810", diagnostics=diagnostics))
+        parser.feed(stream[:300])
+        parser.feed(stream[300:])
+        parser.close()
+        self.assertEqual([(d.code, d.position) for d in diagnostics], [("unrecognized_segment", 3)])
+
+class TestAcknowledgments(unittest.TestCase):
+    """ Tests tracking acceptance while parsing and building 997s from it """
+    def setUp(self):
+        with open("test/test_edi.txt", "r") as test_edi_file:
+            lines = test_edi_file.read().split("\n")
+        envelope, transaction, trailer = lines[:2], lines[2:-3], lines[-3:]
+        second = [line.replace("0001", "0002") for line in transaction]
+        second[1:1] = ["ZZZ^1"] # Unrecognized, and miscounted in SE01
+        second = [line.replace("REF^OQ^500100566875", "REF^OQ") for line in second]
+        trailer[0] = "GE^2^5814"
+        self.stream = "\n".join(envelope + transaction + second + trailer)
+
+    def parse(self, stream):
+        acknowledgments = pythonedi.Acknowledgments()
+        pythonedi.EDIParser(validate=True, acknowledgments=acknowledgments).parse_batch(stream)
+        return acknowledgments
+
+    def test_acceptance(self):
+        group, = self.parse(self.stream).groups
+        self.assertEqual((group.functional_id, group.control_number, group.included), ("IN", "5814", 2))
+        accepted, rejected = group.transactions
+        self.assertEqual((accepted.status, accepted.codes), ("A", []))
+        self.assertEqual((rejected.status, rejected.codes), ("R", ["4", "5"]))
+        self.assertEqual([note[:4] for note in rejected.segment_errors.values()], [["ZZZ", 2, None, "1"], ["REF", 4, None, "8"]])
+        self.assertEqual(group.status, "P")
+
+    def test_envelope_errors(self):
+        stream = self.stream.replace("GE^2^5814", "GE^3^5815").replace("\nSE^262^0001", "")
+        group, = self.parse(stream).groups
+        self.assertEqual(group.codes, ["5", "4"])
+        self.assertEqual(group.transactions[0].codes, ["2"])
+        self.assertEqual(group.status, "R")
+
+    def build(self, acknowledgments):
+        return pythonedi.EDIGenerator().build_acknowledgments(
+            ["00", "", "00", "", "ZZ", "068717859", "ZZ", "043645501", datetime(2017, 3, 12), datetime(2017, 3, 12, 8, 0), "U", "00401", "000000001", "0", "P", "|"],
+            ["FA", "068717859", "SENECA", datetime(2017, 3, 12), datetime(2017, 3, 12, 8, 0), "1", "X", "004010"],
+            acknowledgments.groups)
+
+    def test_segment_count(self):
+        # Zero-padded counts are fine, and blank lines are not segments
+        stream = self.stream.replace("SE^262^0001", "SE^000262^0001").replace("\nBIG^", "\n\nBIG^", 1)
+        group, = self.parse(stream).groups
+        self.assertEqual(group.transactions[0].codes, [])
+
+    def test_unsupported_with_fixed_format(self):
+        stream = self.stream.replace("ST^810^0002", "ST^811^0002")
+        acknowledgments = pythonedi.Acknowledgments()
+        pythonedi.EDIParser(edi_format="810", acknowledgments=acknowledgments).parse_batch(stream)
+        rejected = acknowledgments.groups[0].transactions[1]
+        self.assertEqual(rejected.segment_errors[(rejected.start + 1, "ZZZ")][:4], ["ZZZ", 2, None, "1"])
+
+    def test_missing_mandatory(self):
+        stream = "\n".join(line for line in self.stream.split("\n") if not line.startswith("BIG^")).replace("TDS^", "TDS^^", 1)
+        first = self.parse(stream).groups[0].transactions[0]
+        self.assertEqual(first.status, "R")
+        # A missing segment is noted where its context closes, here at the SE
+        self.assertEqual([note[:4] for note in first.segment_errors.values()], [["TDS", 259, None, "8"], ["BIG", 261, None, "3"]])
+        self.assertEqual(first.segment_errors[(first.start + 258, "TDS")][4], [(1, "1")])
+
+    def test_missing_in_loop(self):
+        message = self.build(self.parse(self.stream))
+        acknowledgment, = self.parse(re.sub(r"AK5\^A[^\n]*\n", "", message)).groups[0].transactions
+        self.assertEqual([note[:4] for note in acknowledgment.segment_errors.values()], [["AK5", 4, None, "3"]])
+
+    def test_bad_elements(self):
+        stream = self.stream.replace("BIG^20170310^", "BIG^2017XX10^", 1).replace("\nCTT^124\n", "\nCTT^124^1^1^1^1\n", 1)
+        acknowledgments = self.parse(stream)
+        first = acknowledgments.groups[0].transactions[0]
+        self.assertEqual([(note[0], note[3], note[4]) for note in first.segment_errors.values()],
+                         [("BIG", "8", [(1, "6")]), ("CTT", "8", [(3, "3")])])
+        for mode in ({"lazy": True}, {"records": True}):
+            again = pythonedi.Acknowledgments()
+            pythonedi.EDIParser(acknowledgments=again, validate=True, **mode).parse_batch(stream)
+            self.assertEqual(again.counts(), acknowledgments.counts())
+        interchange, = pythonedi.EDIParser().parse_batch(self.build(acknowledgments))
+        responses = interchange["groups"][0]["transactions"][0]["L_AK2"]
+        self.assertEqual([response["AK5"]["AK501"] for response in responses], ["R", "R"])
+
+    def test_outside_group(self):
+        stream = "\n".join(line for line in self.stream.split("\n") if not line.startswith(("GS^", "GE^")))
+        acknowledgments = self.parse(stream)
+        self.assertEqual([group.functional_id for group in acknowledgments.groups], [None])
+        interchange, = pythonedi.EDIParser().parse_batch(self.build(acknowledgments))
+        self.assertEqual(interchange["groups"][0]["transactions"], [])
+        self.assertEqual(interchange["groups"][0]["GE"]["GE01"], 0)
+
+    def test_build_997(self):
+        acknowledgments = self.parse(self.stream + "\n" + self.stream.replace("5814", "5815"))
+        message = self.build(acknowledgments)
+        interchange, = pythonedi.EDIParser().parse_batch(message)
+        acks = interchange["groups"][0]["transactions"]
+        self.assertEqual([(ack["ST"]["ST02"], ack["AK1"]["AK102"], ack["SE"]["SE01"]) for ack in acks], [("0001", 5814, 11), ("0002", 5815, 11)])
+        self.assertEqual(acks[0]["AK9"], {"AK901": "P", "AK902": 2, "AK903": 2, "AK904": 1})
+        responses = acks[0]["L_AK2"]
+        self.assertEqual([response["AK5"]["AK501"] for response in responses], ["A", "R"])
+        self.assertEqual(responses[1]["L_AK3"][1]["AK3"], {"AK301": "REF", "AK302": 4, "AK303": "", "AK304": "8"})
+        self.assertEqual(responses[1]["L_AK3"][1]["AK4"], [{"AK401": 2, "AK402": "", "AK403": "2"}])
+        # The 997s are well formed themselves
+        self.assertEqual([group.status for group in self.parse(message).groups], ["A"])
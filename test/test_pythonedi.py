@@ -2,6 +2,7 @@
 Test cases for pythonedi module
 """
 
+import io
 import string
 import random
 import unittest
@@ -167,3 +168,129 @@ class TestGenerate810(unittest.TestCase):
             message = self.g.build(edi_data)
 
         pythonedi.Debug.level = old_level
+
+    def test_build_element(self):
+        big = pythonedi.schema.get_schema("810").paths["810/BIG"]
+        self.assertEqual(self.g.build_element(big.elements[0], datetime(2006, 6, 24)), "20060624")
+        self.assertEqual(self.g.build_element(big.elements[4], None), "")
+        with self.assertRaises(ValueError):
+            self.g.build_element(big.elements[1], None)
+
+def build_invoice(line_items):
+    """ A minimal valid 810 whose L_IT1 loop data is `line_items` """
+    return {
+        "ISA": ["00", "", "00", "", "ZZ", "306000000", "ZZ", "306009503",
+                datetime(2006, 6, 24, 10, 00), datetime(2006, 6, 24, 10, 00),
+                "U", "00401", "000010770", "0", "P", "/"],
+        "GS": ["IN", "306000000", "306009503", datetime(2006, 6, 24, 10, 00),
+               datetime(2006, 6, 24, 10, 00), "1164", "X", "004010"],
+        "ST": ["810", "11640002"],
+        "BIG": [datetime(2006, 6, 24), "INV-00777", datetime(2006, 6, 22), "PO-001063"],
+        "L_IT1": line_items,
+        "TDS": [1234.56],
+        "SE": [5, "11640002"],
+        "GE": [1, 1164],
+        "IEA": [1, "000010770"],
+    }
+
+def line_item(number):
+    return {
+        "IT1": [str(number), 2, "EA", 12.5, None, "VC", "ITEM-{}".format(number)],
+        "L_PID": [{"PID": ["F", None, None, None, "ITEM DESCRIPTION"]}],
+    }
+
+class TestSyntaxRules(unittest.TestCase):
+    """ Tests syntax rules checked while building """
+    def setUp(self):
+        self.g = pythonedi.EDIGenerator()
+        self.old_level = pythonedi.Debug.level
+        pythonedi.Debug.level = 0 # Turn off explaining for intentional exceptions
+
+    def tearDown(self):
+        pythonedi.Debug.level = self.old_level
+
+    def test_if_at_least_one(self):
+        item = line_item(1)
+        # PID04 requires PID03
+        item["L_PID"] = [{"PID": ["F", None, None, "AB", "ITEM DESCRIPTION"]}]
+        with self.assertRaisesRegex(ValueError, "If PID04 is present, at least one of PID03 are required"):
+            self.g.build(build_invoice([item]))
+        item["L_PID"] = [{"PID": ["F", None, "VI", "AB", "ITEM DESCRIPTION"]}]
+        self.assertIn("\nPID^F^^VI^AB^ITEM DESCRIPTION\n", self.g.build(build_invoice([item])))
+
+    def test_all_or_none(self):
+        item = line_item(1)
+        item["IT1"] = ["1", 2, "EA", 12.5, None, "VC"]
+        with self.assertRaisesRegex(ValueError, "If one of IT106, IT107 is present, all are required"):
+            self.g.build(build_invoice([item]))
+
+    def test_diagnostics(self):
+        diagnostics = pythonedi.Diagnostics()
+        g = pythonedi.EDIGenerator(diagnostics=diagnostics)
+        item = line_item(1)
+        item["IT1"] = ["1", 2, "EA", 12.5, None, "VC"]
+        with self.assertRaisesRegex(ValueError, "If one of IT106, IT107 is present, all are required"):
+            g.build(build_invoice([item]))
+        invoice = build_invoice([line_item(1)])
+        del invoice["BIG"]
+        with self.assertRaisesRegex(ValueError, "missing mandatory segment 'BIG'"):
+            g.build(invoice)
+        self.assertEqual([(d.code, d.segment_id, d.element_id) for d in diagnostics],
+                         [("syntax_rule", "IT1", "IT106"), ("missing_segment", "BIG", None)])
+
+class TestStreamingBuild(unittest.TestCase):
+    """ Tests incremental output from the generator """
+    def setUp(self):
+        self.g = pythonedi.EDIGenerator()
+
+    def test_build_to_matches_build(self):
+        expected = self.g.build(build_invoice([line_item(n) for n in range(1, 4)]))
+        stream = io.StringIO()
+        # Loop data can be a generator
+        count = self.g.build_to(build_invoice(line_item(n) for n in range(1, 4)), stream)
+        self.assertEqual(stream.getvalue(), expected)
+        self.assertEqual(count, 14)
+        self.assertIn("\nPID^F^^^^ITEM DESCRIPTION\nIT1^2^", expected)
+
+    def test_build_stats(self):
+        g = pythonedi.EDIGenerator(stats=True)
+        message = g.build(build_invoice([line_item(n) for n in range(1, 4)]))
+        self.assertEqual(g.stats.segments["IT1"], 3)
+        self.assertEqual(g.stats.loops, {"L_IT1": 3, "L_PID": 3})
+        self.assertEqual(g.stats.bytes, len(message) + 1)
+        self.assertEqual(message, self.g.build(build_invoice([line_item(n) for n in range(1, 4)])))
+
+    def test_iter_segments(self):
+        segments = self.g.iter_segments(build_invoice(line_item(n) for n in range(1, 3)))
+        self.assertEqual(next(segments), "ISA^00^          ^00^          ^ZZ^306000000      ^ZZ^306009503      ^060624^1000^U^00401^000010770^0^P^/")
+        self.assertEqual([segment.split("^")[0] for segment in segments],
+                         ["GS", "ST", "BIG", "IT1", "PID", "IT1", "PID", "TDS", "SE", "GE", "IEA"])
+
+class TestBatchBuild(unittest.TestCase):
+    """ Tests building many transaction sets into one interchange """
+    def setUp(self):
+        self.g = pythonedi.EDIGenerator()
+        invoice = build_invoice([line_item(1)])
+        self.isa = invoice.pop("ISA")
+        self.gs = invoice.pop("GS")
+        for trailer in ("SE", "GE", "IEA"):
+            del invoice[trailer]
+        invoice["ST"] = ["810"]
+        self.invoice = invoice
+
+    def transactions(self):
+        for count in range(1, 4):
+            yield dict(self.invoice, L_IT1=[line_item(n) for n in range(1, count + 1)])
+
+    def test_envelope_counts(self):
+        message = self.g.build_batch(self.isa, self.gs, self.transactions(), first_control_number=7)
+        segments = message.split("\n")
+        self.assertEqual([s for s in segments if s.startswith("ST^")], ["ST^810^0007", "ST^810^0008", "ST^810^0009"])
+        self.assertEqual([s for s in segments if s.startswith("SE^")], ["SE^6^0007", "SE^8^0008", "SE^10^0009"])
+        self.assertEqual(segments[-2:], ["GE^3^1164", "IEA^1^000010770"])
+
+    def test_build_batch_to(self):
+        stream = io.StringIO()
+        count = self.g.build_batch_to(self.isa, self.gs, self.transactions(), stream)
+        self.assertEqual(stream.getvalue(), self.g.build_batch(self.isa, self.gs, self.transactions()))
+        self.assertEqual(count, 28)
@@ -0,0 +1,142 @@
+""" Compiled schema test cases for PythonEDI """
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+import pythonedi
+from pythonedi.cache import SchemaCache
+from pythonedi.schema import FormatSchema, get_schema
+from pythonedi.supported_formats import supported_formats
+
+class TestCompiledSchema(unittest.TestCase):
+    """ Tests the precompiled element converters """
+    def setUp(self):
+        self.schema = get_schema("810")
+        self.sections = {section.id: section for section in self.schema}
+
+    def element(self, segment_id, index):
+        return self.sections[segment_id].elements[index]
+
+    def test_compiled_once(self):
+        self.assertIs(get_schema("810"), self.schema)
+
+    def test_date_parsing_matches_strptime(self):
+        big01 = self.element("BIG", 0)
+        for field, pattern in (("20170310", "%Y%m%d"), ("170311", "%y%m%d"), ("991231", "%y%m%d"), ("680101", "%y%m%d")):
+            self.assertEqual(big01.parse(field), datetime.strptime(field, pattern))
+        self.assertEqual(big01.parse(""), "")
+        with self.assertRaises(ValueError):
+            big01.parse("20171340")
+
+    def test_time_parsing_matches_strptime(self):
+        isa10 = self.element("ISA", 9)
+        self.assertEqual(isa10.parse("1102"), datetime.strptime("1102", "%H%M"))
+
+    def test_numeric_conversion(self):
+        tds01 = self.sections["TDS"].elements[0]
+        self.assertEqual(tds01.implied_decimals, 2)
+        self.assertEqual(tds01.parse("2466939"), 24669.39)
+        self.assertEqual(tds01.parse(""), "")
+        self.assertEqual(self.element("GS", 5).parse("5814"), 5814)
+
+    def test_formatting(self):
+        self.assertEqual(self.element("BIG", 0).format(datetime(2006, 6, 24)), "20060624")
+        self.assertEqual(self.element("ISA", 8).format(datetime(2006, 6, 24)), "060624")
+        self.assertEqual(self.element("ISA", 9).format(datetime(2006, 6, 24, 10, 0)), "1000")
+        self.assertEqual(self.sections["TDS"].elements[0].format(1234.5), "1234.50")
+
+class TestFormatRegistry(unittest.TestCase):
+    """ Tests loading formats from extra directories """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        with open(supported_formats.paths["810"]) as format_file:
+            self.definition = json.load(format_file)
+
+    def write(self, format_name, definition):
+        with open(os.path.join(self.directory, format_name + ".json"), "w") as format_file:
+            json.dump(definition, format_file)
+
+    def test_extra_format(self):
+        self.write("810ACME", self.definition)
+        pythonedi.add_format_path(self.directory)
+        try:
+            self.assertIn("810ACME", supported_formats)
+            self.assertEqual(get_schema("810ACME").paths["810ACME/L_IT1/IT1"].id, "IT1")
+        finally:
+            pythonedi.remove_format_path(self.directory)
+        self.assertNotIn("810ACME", supported_formats)
+
+    def test_replace_format(self):
+        original = get_schema("810")
+        for section in self.definition:
+            if section["id"] == "BIG":
+                section["name"] = "Partner Invoice Header"
+        self.write("810", self.definition)
+        pythonedi.add_format_path(self.directory)
+        try:
+            self.assertEqual(get_schema("810").paths["810/BIG"].name, "Partner Invoice Header")
+        finally:
+            pythonedi.remove_format_path(self.directory)
+        self.assertEqual(get_schema("810").paths["810/BIG"].name, original.paths["810/BIG"].name)
+
+    def test_missing_directory(self):
+        missing = os.path.join(self.directory, "missing")
+        with self.assertRaises(FileNotFoundError):
+            pythonedi.add_format_path(missing)
+        self.assertNotIn(missing, supported_formats.search_paths)
+        self.assertIn("810", supported_formats)
+
+class TestSchemaCache(unittest.TestCase):
+    """ Tests the on-disk cache of compiled schemas """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.source = os.path.join(self.directory, "810.json")
+        shutil.copy(supported_formats.paths["810"], self.source)
+
+    def test_invalidation(self):
+        cache = SchemaCache(os.path.join(self.directory, "cache"))
+        schema = cache.load("810", self.source, FormatSchema)
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+        cached = SchemaCache(cache.directory).load("810", self.source, FormatSchema)
+        self.assertEqual(sorted(cached.paths), sorted(schema.paths))
+        self.assertEqual(cached.paths["810/TDS"].elements[0].parse("2466939"), 24669.39)
+        # Touching the file alone does not recompile it
+        os.utime(self.source, ns=(0, 0))
+        cache.load("810", self.source, FormatSchema)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        with open(self.source) as format_file:
+            definition = json.load(format_file)
+        with open(self.source, "w") as format_file:
+            json.dump(definition[:-1], format_file)
+        self.assertEqual(len(cache.load("810", self.source, FormatSchema).sections), len(schema.sections) - 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+class TestDispatch(unittest.TestCase):
+    """ Tests the per-context segment dispatch tables """
+    def test_contexts(self):
+        schema = get_schema("810")
+        item_loop = schema.dispatch["IT1"]
+        self.assertEqual(item_loop.path, "810/L_IT1")
+        # REF and DTM start different sections at header level and in a line item
+        self.assertEqual(schema.dispatch["REF"].path, "810/REF")
+        self.assertEqual(item_loop.dispatch["REF"].path, "810/L_IT1/REF")
+        self.assertEqual(item_loop.dispatch["PID"].path, "810/L_IT1/L_PID")
+        self.assertNotIn("TDS", item_loop.dispatch)
+
+    def test_repeated_ids_parse_by_context(self):
+        with open("test/test_edi.txt") as test_edi_file:
+            test_edi = test_edi_file.read()
+        first_pid = test_edi.index("\nIT1^2^")
+        message = test_edi[:first_pid] + "\nREF^PO^1\nDTM^011^20170310" + test_edi[first_pid:]
+        found_segments, transaction = pythonedi.EDIParser(edi_format="810").parse(message)
+        item = transaction["L_IT1"][0]
+        self.assertEqual(item["REF"], [{"REF01": "PO", "REF02": "1"}])
+        self.assertEqual(item["DTM"][0]["DTM01"], "011")
+        self.assertEqual(len(transaction["L_IT1"][0]["L_PID"]), 1)
+        self.assertEqual([ref["REF01"] for ref in transaction["REF"]], ["OQ", "VN"])